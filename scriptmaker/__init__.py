@@ -1,7 +1,10 @@
 
-from . import constants, data, models, renderer, templates, utilities
+from . import aio, constants, data, models, renderer, server, templates, utilities
 
-from .data import Datastore, Icon, ScriptmakerDataError
+from .aio import AsyncRenderer, ScriptmakerBusyError
+
+from .data import AssetCache, Datastore, DerivativeCache, Fetcher, Icon, ScriptmakerCacheError, ScriptmakerDataError
 from .models import Character, CharacterError, Jinx, Script, ScriptMeta, ScriptOptions
-from .renderer import Renderer, Tokenizer
-from .utilities import PDFTools, ScriptmakerError, ScriptmakerValueError, ScriptmakerFSError
\ No newline at end of file
+from .renderer import BuildStore, DirectoryStorage, MemoryStorage, RenderCache, Renderer, Tokenizer
+from .server import RenderServer
+from .utilities import PDFTools, Profiler, ScriptmakerError, ScriptmakerValueError, ScriptmakerFSError
\ No newline at end of file
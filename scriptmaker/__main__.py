@@ -1,14 +1,18 @@
 
 import argparse 
+import hashlib
 import io
 import json
+import multiprocessing
+import signal
 import sys
+import time
 import traceback
 import urllib.request
    
 from pathlib import Path 
    
-from scriptmaker import Datastore, PDFTools, Renderer, Script, ScriptmakerError, Tokenizer, utilities
+from scriptmaker import AssetCache, BuildStore, Datastore, DerivativeCache, PDFTools, Profiler, RenderCache, RenderServer, Renderer, Script, ScriptmakerError, Tokenizer, data, renderer, utilities
 
 
 def main ():
@@ -34,9 +38,21 @@ def main ():
     styles.add_argument('--full', action = 'store_true')
     styles.add_argument('--simple', action = 'store_true')
     styles.add_argument('--force-jinxes', action = 'store_true')
+    styles.add_argument('--target', choices = ['draft', 'screen', 'print'], default = 'screen')
+    styles.add_argument('--fonts', choices = ['subset', 'full'])
     options = makepdfs.add_argument_group('options')
     options.add_argument('--i18n-fallback', action = 'store_true')
+    options.add_argument('--in-memory', action = 'store_true')
     options.add_argument('--postprocess', action = 'store_true')
+    options.add_argument('--force', action = 'store_true')
+    options.add_argument('--debug-html', action = 'store_true')
+    options.add_argument('--font-report', action = 'store_true')
+    parallelism = makepdfs.add_argument_group('parallelism')
+    parallelism.add_argument('--jobs', type = int, default = 1)
+    parallelism.add_argument('--max-tasks-per-worker', type = int, default = 50)
+    parallelism.add_argument('--task-timeout', type = int, default = 600)
+    add_cache_arguments(makepdfs)
+    add_profile_arguments(makepdfs)
     makepdfs.set_defaults(func = cmd_make_pdf)
     
     # scriptmaker tokenize
@@ -52,74 +68,128 @@ def main ():
     options.add_argument('--reminder-size')
     options.add_argument('--extra-copies')
     options.add_argument('--postprocess', action = 'store_true')
+    options.add_argument('--debug-html', action = 'store_true')
+    options.add_argument('--target', choices = ['draft', 'screen', 'print'], default = 'print')
+    options.add_argument('--fonts', choices = ['subset', 'full'], default = 'full')
+    options.add_argument('--font-report', action = 'store_true')
+    add_cache_arguments(tokenize)
+    add_profile_arguments(tokenize)
     tokenize.set_defaults(func = cmd_tokenize)
 
+    # scriptmaker serve
+
+    serve = subparsers.add_parser('serve')
+    listen = serve.add_argument_group('listen')
+    listen.add_argument('--host', default = '127.0.0.1')
+    listen.add_argument('--port', type = int, default = 8600)
+    listen.add_argument('--socket')
+    limits = serve.add_argument_group('limits')
+    limits.add_argument('--workers', type = int, default = 2)
+    limits.add_argument('--queue-size', type = int, default = 16)
+    limits.add_argument('--timeout', type = int, default = 60)
+    add_cache_arguments(serve)
+    serve.set_defaults(func = cmd_serve)
+
     # Fire
     
     args = parser.parse_args()
-    args.func(args)
+    start_profiling(args)
+    try:
+        with utilities.profiling.span('command'):
+            return args.func(args)
+    finally:
+        finish_profiling(args)
+
+
+def add_cache_arguments (parser):
+    cache = parser.add_argument_group('cache')
+    cache.add_argument('--cache-dir')
+    # Offline runs can only use what is cached, so they need the cache.
+    network = cache.add_mutually_exclusive_group()
+    network.add_argument('--offline', action = 'store_true')
+    network.add_argument('--no-cache', action = 'store_true')
+
+
+def add_profile_arguments (parser):
+    profiling = parser.add_argument_group('profiling')
+    profiling.add_argument('--profile', nargs = '?', const = '-')
+    profiling.add_argument('--profile-prometheus')
+
+
+def start_profiling (args):
+    if getattr(args, 'profile', None) or getattr(args, 'profile_prometheus', None):
+        utilities.profiling.shared = Profiler()
+
+
+def finish_profiling (args):
+    profiler = utilities.profiling.shared
+    if not profiler:
+        return
+    if args.profile == '-':
+        print(json.dumps(profiler.report(), indent = 2, sort_keys = True), file = sys.stderr)
+    elif args.profile:
+        profiler.write_json(args.profile)
+    if args.profile_prometheus:
+        profiler.write_prometheus(args.profile_prometheus)
+
+
+def make_cache (args):
+    if args.no_cache:
+        return None
+    cache_root = Path(args.cache_dir) if args.cache_dir else utilities.filesystem.cache_home()
+    data.derivatives.shared = DerivativeCache(Path(cache_root, 'derivatives'))
+    renderer.store.shared = BuildStore(Path(cache_root, 'build'))
+    renderer.templating.shared = renderer.templating.create_environment(Path(cache_root, 'templates'))
+    return AssetCache(Path(cache_root, 'assets'), offline = args.offline)
 
 
 def fourohfour (args):
-    print('usage: scriptmaker (make-pdf | tokenize)')
+    print('usage: scriptmaker (make-pdf | tokenize | serve)')
     exit(1)
 
 
 def cmd_make_pdf (args):
     
+    # One renderer for every script, so stylesheets, fonts and images are only loaded once.
+    script_renderer = Renderer(in_memory = args.in_memory, debug_html = args.debug_html)
+    
     if args.recurse:     
         if not args.output_folder:
             args.output_folder = Path(args.recurse)
         utilities.filesystem.mkdirp(args.output_folder)
-        datastore = Datastore(args.output_folder)
-        datastore.add_official_characters()
-           
-        for json_path in sorted(Path(args.recurse).resolve().rglob("*.json")):
-            try:
-                with open(json_path) as json_file:
-                    script_json = json.load(json_file)
-
-                if not isinstance (script_json, list) or len(script_json) == 0:
-                    continue
-
-                output_folder = json_path.parent
-                script : Script = datastore.load_script(script_json)
-                
-                if args.i18n_fallback:
-                    script.options.i18n_fallback = True
-
-                if args.force_jinxes:
-                    script.options.force_jinxes = True
-
-                results = set()
-
-                if args.bucket:
-                    script.options.bucket = True
-
-                path = Renderer().render_script(script, output_folder = output_folder)
-                results.add(path)
-
-                if args.full:
-                    script.options.simple_nightorder = False
-                    path = Renderer().render_nightorder(script, output_folder = output_folder)
-                    results.add(path)
-                    
-                if args.simple:
-                    script.options.simple_nightorder = True
-                    paths = Renderer().render_nightorder(script, output_folder = output_folder)
-                    results.add(paths)
-
-                if args.postprocess:
-                    for path in results:
-                        PDFTools.compress(path)
-                        PDFTools.pngify(path)
-                
-                for path in results:
-                    print(str(path))        
-                
-            except (ScriptmakerError, TypeError, Exception):
-                print(traceback.format_exc())
-                continue
+        root = Path(args.recurse).resolve()
+        json_paths = sorted(root.rglob("*.json"))
+        
+        # Scripts whose inputs and outputs haven't changed since the last run are skipped, unless forced.
+        manifest = utilities.manifest.BuildManifest(args.output_folder)
+        keys = [ json_path.relative_to(root).as_posix() for json_path in json_paths ]
+        tasks = [ (json_path, None if args.force else manifest.entries.get(key)) for json_path, key in zip(json_paths, keys) ]
+        
+        if args.jobs > 1:
+            # Results come back in submission order, so output is the same as a serial run.
+            results = render_in_pool(args, tasks)
+        else:
+            datastore = make_recurse_datastore(args)
+            results = ((*render_recursed(datastore, script_renderer, json_path, args, previous = previous, timeout = args.task_timeout), None) for json_path, previous in tasks)
+        
+        counts = { 'rebuilt': 0, 'skipped': 0, 'failed': 0 }
+        try:
+            for key, (status, output, entry, profile) in zip(keys, results):
+                if profile:
+                    utilities.profiling.shared.merge(profile)
+                if output:
+                    print(output, flush = True)
+                if status:
+                    counts[status] += 1
+                if entry:
+                    manifest.entries[key] = entry
+        finally:
+            results.close()
+            # Scripts that are gone (deleted, or renamed) have nothing left to skip.
+            manifest.prune(keys)
+            manifest.save()
+        
+        print(f"{counts['rebuilt']} rebuilt, {counts['skipped']} skipped, {counts['failed']} failed")
     
     else:    
         try:
@@ -142,8 +212,8 @@ def cmd_make_pdf (args):
             if not args.output_folder:
                 args.output_folder = Path(path)
             utilities.filesystem.mkdirp(args.output_folder)
-            datastore = Datastore(args.output_folder)
-            datastore.add_official_characters()
+            datastore = Datastore(args.output_folder, cache = make_cache(args))
+            datastore.add_official_characters(lazy = True)
             
             output_folder = datastore.workspace
             script : Script = datastore.load_script(script_json, nights_json = nights_json)
@@ -157,19 +227,22 @@ def cmd_make_pdf (args):
             if args.force_jinxes:
                 script.options.force_jinxes = True
 
+            script.options.target = args.target
+            script.options.fonts = args.fonts
+
             results = set()
 
-            path = Renderer().render_script(script, output_folder = output_folder)
+            path = script_renderer.render_script(script, output_folder = output_folder)
             results.add(path)
 
             if args.full:
                 script.options.simple_nightorder = False
-                path = Renderer().render_nightorder(script, output_folder = output_folder)
+                path = script_renderer.render_nightorder(script, output_folder = output_folder)
                 results.add(path)
                 
             if args.simple:
                 script.options.simple_nightorder = True
-                path = Renderer().render_nightorder(script, output_folder = output_folder)
+                path = script_renderer.render_nightorder(script, output_folder = output_folder)
                 results.add(path)
 
             if args.postprocess:
@@ -179,6 +252,8 @@ def cmd_make_pdf (args):
             
             for path in results:
                 print(str(path))
+                if args.font_report:
+                    print(font_report(path))
             
         except (ScriptmakerError, TypeError, Exception):
             print(traceback.format_exc())
@@ -186,6 +261,186 @@ def cmd_make_pdf (args):
     return 0
 
 
+def make_recurse_datastore (args):
+    datastore = Datastore(args.output_folder, cache = make_cache(args))
+    datastore.add_official_characters(lazy = True)
+    return datastore.freeze()
+
+
+def build_fingerprint (json_content, script, args):
+    """
+    Hashes everything a script's PDFs are built from: its JSON, its icons and logo, the render options and the scriptmaker version.
+    """
+    inputs = {
+        "script": hashlib.sha256(json_content).hexdigest(),
+        "assets": { character.id: script.data.get_icon(character.id).hash for character in script.characters },
+        "logo": script.meta.icon.hash if script.meta.icon else None,
+        "options": { option: getattr(args, option) for option in ['bucket', 'fonts', 'full', 'simple', 'force_jinxes', 'i18n_fallback', 'postprocess', 'target'] },
+        "version": [utilities.package.version(), data.snapshot.sources_digest()]
+    }
+    return hashlib.sha256(json.dumps(inputs, sort_keys = True).encode()).hexdigest()
+
+
+def render_recursed (datastore, script_renderer, json_path, args, previous = None, timeout = None):
+    """
+    Renders the script at a path into its own folder, unless the previous manifest entry shows it is already up to date.
+    Returns a status (rebuilt, skipped, failed, or None if it isn't a script), what to print (output paths or a traceback), and a new manifest entry.
+    """
+    if timeout and hasattr(signal, 'SIGALRM'):
+        def on_alarm (signum, frame):
+            raise TimeoutError(f"timed out after {timeout}s rendering '{json_path}'")
+        signal.signal(signal.SIGALRM, on_alarm)
+        signal.alarm(timeout)
+    
+    try:
+        with open(json_path, 'rb') as json_file:
+            json_content = json_file.read()
+            script_json = json.loads(json_content)
+
+        if not isinstance (script_json, list) or len(script_json) == 0:
+            return None, None, None
+
+        # Scripts can share a folder (and render at once, with --jobs), so each stages its assets in a build folder of its own.
+        output_folder = json_path.parent
+        build_folder = Path(output_folder, 'build', json_path.stem)
+        script : Script = datastore.overlay().load_script(script_json)
+        
+        fingerprint = build_fingerprint(json_content, script, args)
+        if utilities.manifest.is_current(previous, fingerprint):
+            return 'skipped', None, previous
+        
+        if args.i18n_fallback:
+            script.options.i18n_fallback = True
+
+        if args.force_jinxes:
+            script.options.force_jinxes = True
+
+        script.options.target = args.target
+        script.options.fonts = args.fonts
+
+        results = []
+
+        if args.bucket:
+            script.options.bucket = True
+
+        path = script_renderer.render_script(script, output_folder = output_folder, build_folder = build_folder)
+        results.append(path)
+
+        if args.full:
+            script.options.simple_nightorder = False
+            path = script_renderer.render_nightorder(script, output_folder = output_folder, build_folder = build_folder)
+            results.append(path)
+            
+        if args.simple:
+            script.options.simple_nightorder = True
+            path = script_renderer.render_nightorder(script, output_folder = output_folder, build_folder = build_folder)
+            results.append(path)
+
+        if args.postprocess:
+            for path in results:
+                PDFTools.compress(path)
+                PDFTools.pngify(path)
+        
+        output = [ f"{path}\n{font_report(path)}" if args.font_report else str(path) for path in results ]
+        return 'rebuilt', "\n".join(output), utilities.manifest.make_entry(fingerprint, results)
+        
+    except (ScriptmakerError, TypeError, Exception):
+        return 'failed', traceback.format_exc(), None
+    
+    finally:
+        if timeout and hasattr(signal, 'SIGALRM'):
+            signal.alarm(0)
+
+
+# Per-process state for --jobs workers.
+recurse_worker = {}
+
+# How long past --task-timeout the parent waits on a worker, whose own alarm should have fired by then, before giving up on it.
+TASK_TIMEOUT_GRACE = 5
+
+
+def render_in_pool (args, tasks):
+    """
+    Renders tasks on a pool of worker processes, yielding their results in order.
+    Workers each preload the official characters, and are replaced every so often to cap weasyprint's memory growth.
+    Workers time themselves out, but a worker that hangs in native code or dies never answers, so the parent also gives up on any task running past the timeout; the pool is then replaced, and the tasks it held resubmitted.
+    """
+    context = multiprocessing.get_context()
+    started = context.SimpleQueue() # Workers report each task's index as they start it, which starts its clock; writes are unbuffered, so a worker that dies right after still gets its report out.
+    
+    def __start_pool (indices):
+        pool = context.Pool(args.jobs, initializer = init_recurse_worker, initargs = (args, started), maxtasksperchild = args.max_tasks_per_worker)
+        return pool, { i: pool.apply_async(render_in_worker, ((i, *tasks[i]),)) for i in indices }
+    
+    pool, pending = __start_pool(range(len(tasks)))
+    start_times = {}
+    try:
+        for i, (json_path, _) in enumerate(tasks):
+            while not pending[i].ready():
+                while not started.empty():
+                    start_times[started.get()] = time.monotonic()
+                if args.task_timeout and i in start_times and time.monotonic() - start_times[i] > args.task_timeout + TASK_TIMEOUT_GRACE:
+                    break
+                pending[i].wait(0.2)
+            
+            if pending[i].ready():
+                yield pending.pop(i).get()
+                continue
+            
+            # The worker never answered; take down its pool and start over with everything still pending.
+            pending.pop(i)
+            pool.terminate()
+            while not started.empty():
+                started.get()
+            pool, pending = __start_pool(sorted(pending))
+            start_times = {}
+            yield 'failed', f"timed out after {args.task_timeout}s rendering '{json_path}' (the worker hung or died)", None, None
+    finally:
+        pool.terminate()
+
+
+def init_recurse_worker (args, started):
+    start_profiling(args)
+    recurse_worker['started'] = started
+    datastore = make_recurse_datastore(args)
+    datastore.materialize()
+    recurse_worker['args'] = args
+    recurse_worker['datastore'] = datastore
+    recurse_worker['renderer'] = Renderer(in_memory = args.in_memory, debug_html = args.debug_html).warm_up()
+
+
+def render_in_worker (task):
+    index, json_path, previous = task
+    recurse_worker['started'].put(index)
+    args = recurse_worker['args']
+    result = render_recursed(recurse_worker['datastore'], recurse_worker['renderer'], json_path, args, previous = previous, timeout = args.task_timeout)
+    
+    # Each task's share of the worker's profile goes back with its result, to be merged by the parent.
+    profiler = utilities.profiling.shared
+    return (*result, profiler.drain() if profiler else None)
+
+
+def font_report (path):
+    """
+    Summarizes the font bytes embedded in a PDF.
+    """
+    fonts = PDFTools.fonts(path)
+    details = ", ".join(f"{font['name']} {font['bytes']:,}" for font in sorted(fonts, key = lambda font: -font['bytes']))
+    return f"  fonts: {sum(font['bytes'] for font in fonts):,} bytes embedded ({details if details else 'none'})"
+
+
+def cmd_serve (args):
+    
+    # The official characters and every worker's renderer are loaded before the first request, not during it.
+    datastore = Datastore(cache = make_cache(args))
+    datastore.add_official_characters(lazy = True)
+    server = RenderServer(datastore, workers = args.workers, queue_size = args.queue_size, timeout = args.timeout, cache = RenderCache()).warm_up()
+    
+    print(f"serving on {args.socket if args.socket else f'http://{args.host}:{args.port}'}", flush = True)
+    server.serve(host = args.host, port = args.port, unix_socket = args.socket)
+    return 0
+
+
 def cmd_tokenize (args):
     
     script_count = 0
@@ -194,10 +449,10 @@ def cmd_tokenize (args):
     if not args.output_folder:
         args.output_folder = Path(directory)
     utilities.filesystem.mkdirp(args.output_folder)
-    datastore = Datastore(args.output_folder)
+    datastore = Datastore(args.output_folder, cache = make_cache(args))
     
     if not args.exclude_official:
-        datastore.add_official_characters()
+        datastore.add_official_characters(lazy = not args.official_only)
     
     if args.extra_copies:
         with open(args.extra_copies) as f:
@@ -240,13 +495,15 @@ def cmd_tokenize (args):
         if args.reminder_size: params['reminder_token_size'] = int(args.reminder_size)
         
         datastore.characters = dict(sorted(datastore.characters.items(), key=lambda item: item[0]))
-        output_files = Tokenizer().render(datastore, ** params)
+        output_files = Tokenizer(debug_html = args.debug_html, fonts = args.fonts, target = args.target).render(datastore, ** params)
         
         for output_file in output_files:
             if args.postprocess:
                 PDFTools.compress(output_file)
                 PDFTools.pngify(output_file)
             print(str(output_file))
+            if args.font_report:
+                print(font_report(output_file))
 
     return 0
 
@@ -0,0 +1,137 @@
+from __future__ import annotations
+
+import asyncio
+import io
+import os
+import threading
+
+import scriptmaker.renderer as renderer
+import scriptmaker.utilities as utilities
+
+
+class ScriptmakerBusyError(utilities.ScriptmakerError):
+    """
+    Raised when an AsyncRenderer already has as many renders waiting as it allows.
+    """
+
+
+class AsyncRenderer ():
+    """
+    Runs scriptmaker's blocking work (loading scripts, rendering PDFs) in an executor, so an event loop can serve many render requests at once.
+    Each executor thread gets its own Renderer, since weasyprint's font state is not shared across threads.
+    Renders are always in memory, so requests never share a build folder; each PDF is written out whole once rendered.
+    """
+
+    def __init__ (
+        self, *,
+        cache = None, # A RenderCache shared by every thread's Renderer
+        trusted = True, # As in Renderer(); pass False for scripts from requests
+        executor = None, # A concurrent.futures executor for blocking work; the loop's default if None
+        max_concurrent = 4, # Renders running at once
+        max_waiting = 16 # Renders queued behind those before new ones are refused; None for no limit
+    ):
+        """
+        Creates an async renderer. Must be used from a single event loop.
+        """
+        self.cache = cache
+        self.trusted = trusted
+        self.executor = executor
+        self.max_concurrent = max_concurrent
+        self.max_waiting = max_waiting
+
+        self.__slots = asyncio.Semaphore(max_concurrent)
+        self.__waiting = 0
+        self.__local = threading.local()
+        self.__paths = renderer.Renderer() # Only used to work out output paths on the loop
+
+
+    async def load_script (self, datastore, script_json, nights_json = None):
+        """
+        Loads a script into a datastore (see Datastore.load_script), fetching its remote icons and logo concurrently off the event loop.
+        Use a fresh overlay() per request, so that concurrent loads never share a datastore.
+        """
+        return await asyncio.get_running_loop().run_in_executor(self.executor, datastore.load_script, script_json, nights_json)
+
+
+    async def render_nightorder (self, script, *, output_folder = None):
+        """
+        Renders the nightorder PDF (see Renderer.render_nightorder), returning the file path.
+        """
+        return await self.__render('render_nightorder', 'nightorder_path', script, output_folder)
+
+
+    async def render_script (self, script, *, output_folder = None):
+        """
+        Renders the script PDF (see Renderer.render_script), returning the file path.
+        """
+        return await self.__render('render_script', 'script_path', script, output_folder)
+
+
+    def __renderer (self):
+        """
+        The calling thread's Renderer.
+        """
+        if not hasattr(self.__local, 'renderer'):
+            self.__local.renderer = renderer.Renderer(cache = self.cache, trusted = self.trusted)
+        return self.__local.renderer
+
+
+    async def __render (self, method, path_method, script, output_folder):
+        """
+        Waits for a slot, then runs a render in the executor. If the caller gives up (cancellation, or the render fails), the output is not written, or removed once the executor is done with it.
+        The slot is held until the executor is done, even if the caller has given up, so no more than max_concurrent renders ever run.
+        """
+        if self.max_waiting is not None and self.__slots.locked() and self.__waiting >= self.max_waiting:
+            raise ScriptmakerBusyError(f"{self.__waiting} renders are already waiting; try again later")
+
+        self.__waiting += 1
+        try:
+            await self.__slots.acquire()
+        finally:
+            self.__waiting -= 1
+
+        loop = asyncio.get_running_loop()
+        try:
+            output_path = getattr(self.__paths, path_method)(script, output_folder = output_folder)
+        except BaseException:
+            self.__slots.release()
+            raise
+
+        abandoned = threading.Event()
+        written = []
+
+        def __run ():
+            # Rendered in memory, so concurrent renders never share staged assets (or decoded images of them), and nothing lands in the output folder until the PDF is whole.
+            content = getattr(self.__renderer(), method)(script, stream = io.BytesIO()).getvalue()
+            if not abandoned.is_set():
+                utilities.filesystem.mkdirp(output_path.parent)
+                utilities.filesystem.write_atomic(output_path, content)
+                written.append(self.__identity(output_path))
+            return output_path
+
+        def __clean_up (future):
+            # Another render may have replaced the file since; only remove it if it is still this one's.
+            if written and self.__identity(output_path) == written[0]:
+                output_path.unlink(missing_ok = True)
+
+        future = loop.run_in_executor(self.executor, __run)
+        future.add_done_callback(lambda _: self.__slots.release())
+        try:
+            return await asyncio.shield(future)
+        except BaseException:
+            # The executor can't be interrupted; it skips writing if it hasn't yet, and whatever it already wrote is thrown away once it's done.
+            abandoned.set()
+            future.add_done_callback(__clean_up)
+            raise
+
+
+    @staticmethod
+    def __identity (path):
+        """
+        Identifies the current version of a file (atomic writes always make a new one), or None if it doesn't exist.
+        """
+        try:
+            stat = os.stat(path)
+            return (stat.st_dev, stat.st_ino, stat.st_mtime_ns, stat.st_size)
+        except OSError:
+            return None
@@ -1,4 +1,15 @@
 
 NIGHT_META = ['dusk', 'minioninfo', 'demoninfo', 'dawn']
 OFFICIAL_EDITIONS = ['tb', 'bmr', 'snv', 'base3', 'ks', 'experimental']
-TEAMS = ['townsfolk', 'outsider', 'minion', 'demon', 'traveler', 'fabled', 'loric']
\ No newline at end of file
+TEAMS = ['townsfolk', 'outsider', 'minion', 'demon', 'traveler', 'fabled', 'loric']
+
+# Output targets decide how much image and font data goes into a PDF; dpi is the resolution icons are rendered at, or None for the full-quality sources.
+# background_dpi is the resolution packaged backgrounds (parchment, token art) are downsampled to; fonts is the default font embedding policy (see FONT_POLICIES).
+OUTPUT_TARGETS = {
+    'draft': { 'dpi': 96, 'background_dpi': 96, 'fonts': 'subset' },
+    'screen': { 'dpi': 192, 'background_dpi': 150, 'fonts': 'subset' },
+    'print': { 'dpi': None, 'background_dpi': 300, 'fonts': 'full' }
+}
+
+# How fonts are embedded: only the glyphs a PDF uses, or every font file whole (so printers can edit or re-rip it).
+FONT_POLICIES = ['subset', 'full']
@@ -1,6 +1,12 @@
 
 from . import compiled
+from . import derivatives
 from . import icons 
+from . import remote
+from . import snapshot
 
+from .cache import AssetCache, ScriptmakerCacheError
+from .derivatives import DerivativeCache
 from .datastore import Datastore, DatastoreEncoder, ScriptmakerDataError
 from .icon import Icon
+from .remote import Fetcher
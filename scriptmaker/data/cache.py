@@ -0,0 +1,244 @@
+from __future__ import annotations
+
+import hashlib
+import json
+import os
+import threading
+import time
+import urllib.error
+import urllib.request
+
+from pathlib import Path
+
+import scriptmaker.utilities as utilities
+
+
+class ScriptmakerCacheError(utilities.ScriptmakerError):
+    """
+    Raised when the asset cache cannot satisfy a request, e.g. a miss while offline.
+    """
+
+
+class AssetCache ():
+    """
+    A persistent cache of remote assets (character icons, script logos) that lives on disk.
+    Entries are keyed by URL, while the stored bytes are deduplicated by their content hash.
+    """
+
+    def __init__ (
+        self, directory = None, *,
+        max_bytes = 256 * 1024 * 1024, # Total size of stored content before the least recently used entries are evicted
+        ttl = 7 * 24 * 60 * 60, # Seconds before an entry is revalidated against its origin
+        offline = False, # If True, never touches the network; stale entries are served and misses raise
+        timeout = 30 # Seconds to wait on the network per request
+    ):
+        """
+        Opens (or creates) a cache; if no directory is given, uses the user's scriptmaker cache.
+        """
+        self.directory = Path(directory) if directory else Path(utilities.filesystem.cache_home(), 'assets')
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.offline = offline
+        self.timeout = timeout
+
+        self.stats = { 'hits': 0, 'misses': 0, 'revalidated': 0, 'stale': 0, 'evictions': 0 }
+        self.__lock = threading.RLock()
+
+        utilities.filesystem.mkdirp(Path(self.directory, 'objects'))
+        utilities.filesystem.mkdirp(Path(self.directory, 'urls'))
+        self.__stored_bytes = self.size() # Counted on open, then kept up to date (by this process)
+
+
+    def clear (self):
+        """
+        Removes every entry and all stored content.
+        """
+        with self.__lock:
+            for folder in ['urls', 'objects']:
+                for path in Path(self.directory, folder).iterdir():
+                    path.unlink(missing_ok = True)
+            self.__stored_bytes = 0
+
+
+    def fetch (self, url, timeout = None):
+        """
+        Returns the bytes behind a URL, from the cache if possible; timeout (seconds) overrides the cache's own for any request this makes.
+        """
+        entry = self.__read_entry(url)
+        content = self.__read_object(entry['hash']) if entry else None
+
+        if content is not None:
+            fresh = time.time() - entry['fetched'] < self.ttl
+            if fresh or self.offline:
+                self.__record('hits')
+                self.__touch(url)
+                return content
+
+            # Expired; ask the origin whether our copy is still good.
+            try:
+                status, new_content, headers = self.__download(url, entry, timeout)
+            except Exception:
+                # The origin is unreachable, but a stale icon beats no icon.
+                self.__record('stale')
+                self.__touch(url)
+                return content
+
+            if status == 304:
+                self.__record('hits')
+                self.__record('revalidated')
+                entry['fetched'] = time.time()
+                self.__write_entry(url, entry)
+                return content
+
+            self.__record('misses')
+            self.__store(url, new_content, headers)
+            return new_content
+
+        self.__record('misses')
+        if self.offline:
+            raise ScriptmakerCacheError(f"'{url}' is not cached, and the cache is offline")
+
+        _, content, headers = self.__download(url, None, timeout)
+        self.__store(url, content, headers)
+        return content
+
+
+    def size (self):
+        """
+        Returns the number of bytes of content currently stored.
+        """
+        return sum(path.stat().st_size for path in Path(self.directory, 'objects').iterdir() if path.is_file())
+
+
+    def __download (self, url, entry, timeout = None):
+        """
+        Performs a (conditional, if we hold an entry) GET, returning the status, body and response headers.
+        """
+        request = urllib.request.Request(url)
+        if entry and entry.get('etag'):
+            request.add_header('If-None-Match', entry['etag'])
+        if entry and entry.get('last_modified'):
+            request.add_header('If-Modified-Since', entry['last_modified'])
+
+        try:
+            with urllib.request.urlopen(request, timeout = timeout if timeout is not None else self.timeout) as response:
+                return getattr(response, 'status', 200), response.read(), response.headers
+        except urllib.error.HTTPError as err:
+            if err.code == 304:
+                return 304, None, err.headers
+            raise
+
+
+    def __entry_path (self, url):
+        """
+        Locates the metadata file for a URL.
+        """
+        return Path(self.directory, 'urls', f"{hashlib.sha256(url.encode()).hexdigest()}.json")
+
+
+    def __evict (self):
+        """
+        Drops least recently used entries until the stored content fits in the size cap, then removes unreferenced content.
+        """
+        entries = []
+        for path in Path(self.directory, 'urls').glob('*.json'):
+            try:
+                with open(path) as entry_file:
+                    entries.append((path.stat().st_mtime, path, json.load(entry_file)))
+            except (OSError, ValueError):
+                path.unlink(missing_ok = True)
+        entries.sort(key = lambda item: item[0])
+
+        sizes = { entry['hash']: entry['size'] for _, _, entry in entries }
+        references = {}
+        for _, _, entry in entries:
+            references[entry['hash']] = references.get(entry['hash'], 0) + 1
+        total = sum(sizes.values())
+
+        for _, path, entry in entries:
+            if total <= self.max_bytes:
+                break
+            path.unlink(missing_ok = True)
+            self.__record('evictions')
+            references[entry['hash']] -= 1
+            if references[entry['hash']] == 0:
+                total -= sizes[entry['hash']]
+
+        for path in Path(self.directory, 'objects').iterdir():
+            if references.get(path.name, 0) == 0 and not path.name.startswith('.'):
+                path.unlink(missing_ok = True)
+        self.__stored_bytes = total
+
+
+    def __read_entry (self, url):
+        """
+        Reads the metadata for a URL, if there is any.
+        """
+        try:
+            with open(self.__entry_path(url)) as entry_file:
+                return json.load(entry_file)
+        except (OSError, ValueError):
+            return None
+
+
+    def __read_object (self, content_hash):
+        """
+        Reads stored content by hash, if it is still there.
+        """
+        try:
+            with open(Path(self.directory, 'objects', content_hash), 'rb') as object_file:
+                return object_file.read()
+        except OSError:
+            return None
+
+
+    def __record (self, stat):
+        """
+        Bumps one of the cache's counters.
+        """
+        with self.__lock:
+            self.stats[stat] += 1
+        utilities.profiling.count(f"asset_cache_{stat}")
+
+
+    def __store (self, url, content, headers):
+        """
+        Saves content under its hash (once), points the URL at it, and enforces the size cap.
+        """
+        content_hash = hashlib.sha256(content).hexdigest()
+        object_path = Path(self.directory, 'objects', content_hash)
+        if not object_path.exists():
+            utilities.filesystem.write_atomic(object_path, content)
+            with self.__lock:
+                self.__stored_bytes += len(content)
+
+        self.__write_entry(url, {
+            'url': url,
+            'hash': content_hash,
+            'size': len(content),
+            'fetched': time.time(),
+            'etag': headers.get('ETag') if headers else None,
+            'last_modified': headers.get('Last-Modified') if headers else None
+        })
+
+        # Only a cache that looks full is scanned; other processes may share the directory, so the scan recounts it.
+        with self.__lock:
+            if self.__stored_bytes > self.max_bytes:
+                self.__evict()
+
+
+    def __touch (self, url):
+        """
+        Marks an entry as recently used; the entry file's mtime drives LRU eviction.
+        """
+        try:
+            os.utime(self.__entry_path(url))
+        except OSError:
+            pass
+
+
+    def __write_entry (self, url, entry):
+        """
+        Saves the metadata for a URL.
+        """
+        utilities.filesystem.write_atomic(self.__entry_path(url), json.dumps(entry).encode())
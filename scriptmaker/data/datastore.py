@@ -1,13 +1,15 @@
 from __future__ import annotations
 
+import hashlib
 import json
 import pkgutil
 import tempfile
-import urllib
+import threading
 
+from collections import ChainMap
 from pathlib import Path
 
-from . import compiled, icons
+from . import compiled, icons, remote, snapshot
 from .icon import Icon
 
 import scriptmaker.constants as constants
@@ -51,39 +53,67 @@ class Datastore ():
     A collection of loaded characters living in a workspace.
     """
     
-    def __init__ (self, workspace = None):
+    def __init__ (self, workspace = None, cache = None, fetcher = None, base = None):
         """
         Scripts that are complete homebrews probably don't need to always load official resources, so they are initialized only with nightmeta.
+        Remote icons and logos go through the given AssetCache, if any; pass a Fetcher to tune download concurrency and timeouts.
+        With a (frozen) base, this datastore is an overlay: it sees the base's characters, but only ever adds to itself. See overlay().
         """
-        self.workspace = workspace if workspace else tempfile.TemporaryDirectory()
+        if base and not workspace:
+            workspace = base.workspace
+        self.__tmpdir = None if workspace else tempfile.TemporaryDirectory()
+        self.workspace = workspace if workspace else self.__tmpdir.name
         utilities.filesystem.mkdirp(self.workspace)
         
-        self.characters : dict[str, models.Character] = {}
-        self.icons : dict[str, models.Icon] = {}
-        self.__load_nightmeta_characters()
+        self.base = base
+        self.frozen = False
+        self.__lock = threading.RLock()
+        self.__unloaded : dict[str, dict] = {} # Raw entries of official characters that have not been materialized yet.
+        
+        if base:
+            self.cache = cache if cache else base.cache
+            self.fetcher = fetcher if fetcher else remote.Fetcher(self.cache, max_workers = base.fetcher.max_workers, per_host = base.fetcher.per_host, timeout = base.fetcher.timeout)
+            self.characters : dict[str, models.Character] = ChainMap({}, base.characters)
+            self.icons : dict[str, models.Icon] = ChainMap({}, base.icons)
+            self.__snapshot = None
+        else:
+            self.cache = cache
+            self.fetcher = fetcher if fetcher else remote.Fetcher(cache)
+            self.characters : dict[str, models.Character] = {}
+            self.icons : dict[str, models.Icon] = {}
+            self.__snapshot = snapshot.load() # Pre-validated catalogue; None means we go through the compiled JSON instead.
+            self.__load_nightmeta_characters()
     
     
     def add_character (self, character):
         """
         Adds a homebrew character to the data. 
         """
-        if character.id in self.characters:
+        self.__check_mutable()
+        if self.has_character(character.id):
             raise ScriptmakerDataError(f"data already contains id '{character.id}'")
         self.characters[character.id] = character
         self.__fetch_icon(character.id)
-        
     
-    def add_official_characters (self):
+    
+    def add_official_characters (self, lazy = False):
         """
         Loads all official characters (and nightmeta) from the package.
+        If lazy, only an index of ids is kept; each character and its icon are built the first time they are requested.
         """
+        self.__check_mutable()
+        if self.base:
+            raise ScriptmakerDataError("overlays share their base's official characters; add them to the base instead")
         try:
-            official = json.loads(compiled.get_data("official.json"))
-            for _, character in official.items():
-                character['image'] = 'local-icon'
-                loaded_char = models.Character.from_dict(character)
-                self.characters[loaded_char.id] = loaded_char
-                self.__load_package_icon(loaded_char.id)
+            with utilities.profiling.span('datastore.add_official_characters'):
+                official = self.__snapshot['official'] if self.__snapshot else json.loads(compiled.get_data("official.json"))
+                for _, character in official.items():
+                    if lazy:
+                        id = utilities.sanitize.id(character['id'])
+                        if id not in self.characters:
+                            self.__unloaded[id] = character
+                    else:
+                        self.__load_official_character(character)
         except Exception as prev:
             raise ScriptmakerDataError("failed to load official characters") from prev
     
@@ -92,74 +122,108 @@ class Datastore ():
         """
         Saves the contents of this data to its workspace.
         """
+        self.materialize()
+        
         with open(Path(self.workspace, "characters.json"), "w") as json_file:
-            json.dump(self.characters, json_file, cls = DatastoreEncoder, indent=2)
+            json.dump(dict(self.characters), json_file, cls = DatastoreEncoder, indent=2)
 
         icons_path = Path(self.workspace, "icons")
         utilities.filesystem.mkdirp(icons_path)        
         for character in self.icons:
             self.icons[character].save(icons_path)
-        
-        
+    
+    
+    def freeze (self):
+        """ 
+        Makes this datastore immutable, so that it can be shared (e.g. across threads or forked workers) as the base of many overlays.
+        Lazily-indexed characters can still be materialized.
+        """
+        self.frozen = True
+        return self
+    
+    
     def get_character (self, id):
         """
         Get a character in the dataset.
         """
+        self.__resolve(id)
         if id not in self.characters:
             raise ScriptmakerDataError(f"id '{id}' is not a character")
         return self.characters[id]
-
+    
     
     def get_icon (self, id):
         """ 
         Get a character icon from the dataset.
         """
+        self.__resolve(id)
         if id not in self.icons:
             raise ScriptmakerDataError(f"id '{id}' has no icon")
         return self.icons[id]
-
+    
+    
+    def has_character (self, id):
+        """ 
+        Checks whether the dataset knows about a character, whether or not it has been materialized yet.
+        """
+        if id in self.characters or id in self.__unloaded:
+            return True
+        return self.base.has_character(id) if self.base else False
+    
     
     def load_script (self, script_json, nights_json = None):
         """
         Loads a script's homebrewed characters into this datastore, then builds the corresponding Script.
+        Every remote icon (and the logo) the script needs is fetched concurrently before any character is added.
         """
-        script = models.Script(data = self, nights = nights_json)
+        with utilities.profiling.span('datastore.load_script'):
+            return self.__load_script(script_json, nights_json)
+    
+    
+    def materialize (self, ids = None):
+        """ 
+        Builds the given lazily-indexed official characters and their icons; if no ids are given, builds everything still pending.
+        """
+        if self.base:
+            self.base.materialize(ids)
         
-        for character in script_json:
-            # Handle modern-format base3+experimental scripts.
-            if isinstance(character, str):
-                id = utilities.sanitize.id(character)
-                if id not in self.characters:
-                    raise ScriptmakerDataError(f"character '{character}' (-> '{id}') is not an official character; cannot be string-loaded")
-                script.add(id)
-                continue
-
-            # Otherwise, figure out what's going on with this character.                
-            if character['id'] == "_meta":
-                if 'name' in character: script.meta.name = character['name']
-                if 'author' in character: script.meta.author = character['author']
-                if 'logo' in character: script.meta.add_logo(character['logo'])
-            else:
-                character['id'] = utilities.sanitize.id(character['id'])
-                if character['id'] in self.characters:
-                    char = self.get_character(character['id']).__dict__
-                    id = char['id']
-                else:
-                    char = models.Character.from_dict(character)
-                    self.add_character(char)
-                    id = char.id
-                script.add(id)
-                
-        return script
+        with self.__lock:
+            ids = list(self.__unloaded.keys()) if ids is None else ids
+            try:
+                for id in ids:
+                    if id in self.__unloaded:
+                        # Only drop the index entry once the character and icon are both in place, so readers never see a half-built id.
+                        self.__load_official_character(self.__unloaded[id])
+                        del self.__unloaded[id]
+            except Exception as prev:
+                raise ScriptmakerDataError("failed to load official characters") from prev
+    
+    
+    def overlay (self, workspace = None):
+        """ 
+        Freezes this datastore, and returns a cheap copy-on-write datastore over it to load a single script's homebrew into.
+        """
+        self.freeze()
+        return Datastore(workspace, base = self)
     
     
     def remove_character (self, id):
         """ 
-        Removes a character from this dataset.
+        Removes a character from this dataset. Overlays can only remove their own characters.
         """
+        self.__check_mutable()
         self.characters.pop(id, None)
         self.icons.pop(id, None)
-        
+        self.__unloaded.pop(id, None)
+    
+    
+    def __check_mutable (self):
+        """ 
+        Guards against changes to a frozen datastore.
+        """
+        if self.frozen:
+            raise ScriptmakerDataError("datastore is frozen; load scripts into an overlay() instead")
+    
     
     def __fetch_icon (self, id):
         """ 
@@ -167,11 +231,9 @@ class Datastore ():
         """
         try:
             image_url = self.get_character(id).image
-            with tempfile.NamedTemporaryFile("w+b") as tmp:
-                urllib.request.urlretrieve(image_url, tmp.name)
-                self.icons[id] = Icon(id, tmp.read())
+            self.icons[id] = Icon(id, self.fetcher.fetch(image_url))
         except Exception as prev:
-            raise ScriptmakerDataError(f"failed to fetch remote icon for character '{id}' from '{image_url}'")    
+            raise ScriptmakerDataError(f"failed to fetch remote icon for character '{id}' from '{image_url}'")
     
     
     def __load_nightmeta_characters (self):
@@ -179,21 +241,125 @@ class Datastore ():
         Loads all nightmeta characters.
         """
         try:
-            nightmeta = json.loads(compiled.get_data("nightmeta.json"))
+            nightmeta = self.__snapshot['nightmeta'] if self.__snapshot else json.loads(compiled.get_data("nightmeta.json"))
             for _, character in nightmeta.items():
-                nightmeta_char = models.Character.from_dict(character)
+                if self.__snapshot:
+                    nightmeta_char = models.Character.from_snapshot(character)
+                else:
+                    nightmeta_char = models.Character.from_dict(character)
                 self.characters[nightmeta_char.id] = nightmeta_char
                 self.__load_package_icon(nightmeta_char.id)
         except Exception as prev:
             raise ScriptmakerDataError("failed to load nightmeta") from prev
     
     
+    def __load_official_character (self, character):
+        """ 
+        Builds an official character from its compiled entry (or snapshot state), along with its packaged icon.
+        """
+        if self.__snapshot:
+            loaded_char = models.Character.from_snapshot(character)
+        else:
+            loaded_char = models.Character.from_dict(dict(character, image = 'local-icon'))
+        self.characters[loaded_char.id] = loaded_char
+        self.__load_package_icon(loaded_char.id)
+    
+    
     def __load_package_icon (self, id):
         """ 
         Loads an icon from the package. Only official and nightmeta characters can be loaded in this way.
         """
         try:
             icon_data = icons.get_data(f"Icon_{id}.png")
-            self.icons[id] = Icon(id, icon_data)
+            icon_info = self.__snapshot['icons'].get(id, {}) if self.__snapshot else {}
+            
+            # The icons aren't part of the snapshot's sources digest, so an icon changed since the last assemble must not be known by its old hash (or crop box).
+            icon_hash = hashlib.sha256(icon_data).hexdigest()
+            bbox = icon_info.get('bbox') if icon_info.get('hash') == icon_hash else None
+            self.icons[id] = Icon(id, icon_data, hash = icon_hash, bbox = bbox)
         except Exception as prev:
-            raise ScriptmakerDataError("failed to load icon from package") from prev
\ No newline at end of file
+            raise ScriptmakerDataError("failed to load icon from package") from prev
+    
+    
+    def __load_script (self, script_json, nights_json):
+        """
+        Does the work of load_script.
+        """
+        script = models.Script(data = self, nights = nights_json)
+        
+        # Work out what each entry is without touching the network, stopping at the first bad one.
+        steps, failure = [], None
+        new_ids = set()
+        for character in script_json:
+            try:
+                steps.append(self.__plan_entry(character, new_ids))
+            except Exception as err:
+                failure = err
+                break
+        
+        try:
+            self.fetcher.prefetch([ self.__remote_url(kind, entry) for kind, entry in steps ])
+            
+            # Build the script in order, so that errors surface exactly as they would have one entry at a time.
+            for kind, entry in steps:
+                match kind:
+                    case 'meta':
+                        if 'name' in entry: script.meta.name = entry['name']
+                        if 'author' in entry: script.meta.author = entry['author']
+                        if 'logo' in entry: script.meta.add_logo(entry['logo'], fetcher = self.fetcher)
+                    case 'homebrew':
+                        self.add_character(entry)
+                        script.add(entry.id)
+                    case _:
+                        script.add(entry)
+        finally:
+            self.fetcher.discard()
+        
+        if failure:
+            raise failure
+        return script
+    
+    
+    def __plan_entry (self, character, new_ids):
+        """ 
+        Classifies a script entry as ('meta', block), ('homebrew', Character) or ('known', id), raising if it is unusable.
+        """
+        # Handle modern-format base3+experimental scripts.
+        if isinstance(character, str):
+            id = utilities.sanitize.id(character)
+            if not self.has_character(id):
+                raise ScriptmakerDataError(f"character '{character}' (-> '{id}') is not an official character; cannot be string-loaded")
+            return ('known', id)
+        
+        # Otherwise, figure out what's going on with this character.
+        if character['id'] == "_meta":
+            return ('meta', character)
+        
+        character['id'] = utilities.sanitize.id(character['id'])
+        if self.has_character(character['id']) or character['id'] in new_ids:
+            return ('known', character['id'])
+        
+        char = models.Character.from_dict(character)
+        new_ids.add(char.id)
+        return ('homebrew', char)
+    
+    
+    def __remote_url (self, kind, entry):
+        """ 
+        Finds the remote asset a planned entry will need, if any.
+        """
+        if kind == 'homebrew':
+            return entry.image
+        if kind == 'meta':
+            return entry.get('logo')
+        return None
+    
+    
+    def __resolve (self, id):
+        """ 
+        Materializes an id if it is only indexed, whether here or in the base.
+        """
+        if id in self.__unloaded:
+            self.materialize([id])
+        elif self.base and id not in self.characters:
+            self.base.__resolve(id)
@@ -0,0 +1,121 @@
+from __future__ import annotations
+
+import hashlib
+import os
+import threading
+
+from collections import OrderedDict
+from pathlib import Path
+
+import scriptmaker.utilities as utilities
+
+
+class DerivativeCache ():
+    """
+    Remembers images derived from other images (crops, resizes), keyed by the source's content hash and the operation's parameters.
+    Derivatives are kept in memory, and also on disk if the cache is given a directory.
+    """
+
+    def __init__ (self, directory = None, *, max_entries = 1024, max_bytes = 256 * 1024 * 1024):
+        """
+        Creates a cache holding up to max_entries derivatives in memory, and (with a directory) up to max_bytes of them on disk, evicting the least recently used.
+        """
+        self.directory = Path(directory) if directory else None
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.stats = { 'hits': 0, 'misses': 0, 'evictions': 0 }
+
+        self.__entries : OrderedDict[str, bytes] = OrderedDict()
+        self.__lock = threading.Lock()
+        self.__disk_bytes = None # Counted on the first write, then kept up to date (by this process)
+
+        if self.directory:
+            utilities.filesystem.mkdirp(self.directory)
+
+
+    def get (self, key, create):
+        """
+        Returns the derivative for a key such as ('crop', hash), calling create() to produce its bytes on a miss.
+        """
+        name = hashlib.sha256(repr(key).encode()).hexdigest()
+
+        with self.__lock:
+            if name in self.__entries:
+                self.__entries.move_to_end(name)
+                self.stats['hits'] += 1
+                return self.__entries[name]
+
+        content = self.__read(name)
+        if content is None:
+            content = create()
+            self.__write(name, content)
+            stat = 'misses'
+        else:
+            stat = 'hits'
+
+        with self.__lock:
+            self.stats[stat] += 1
+            self.__entries[name] = content
+            while len(self.__entries) > self.max_entries:
+                self.__entries.popitem(last = False)
+        return content
+
+
+    def __evict (self):
+        """
+        Drops least recently used (by mtime) derivatives from disk until the rest fit in the size cap.
+        """
+        entries = []
+        for path in self.directory.iterdir():
+            if path.name.startswith('.'):
+                continue
+            try:
+                stat = path.stat()
+                entries.append((stat.st_mtime, stat.st_size, path))
+            except OSError:
+                continue
+        entries.sort()
+
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in entries:
+            if total <= self.max_bytes:
+                break
+            path.unlink(missing_ok = True)
+            self.stats['evictions'] += 1
+            total -= size
+        self.__disk_bytes = total
+
+
+    def __read (self, name):
+        """
+        Reads a persisted derivative, if there is one, marking it as recently used.
+        """
+        if not self.directory:
+            return None
+        path = Path(self.directory, name)
+        try:
+            with open(path, 'rb') as derivative_file:
+                content = derivative_file.read()
+            os.utime(path)
+            return content
+        except OSError:
+            return None
+
+
+    def __write (self, name, content):
+        """
+        Persists a derivative, if this cache has a directory, then enforces the size cap.
+        """
+        if not self.directory:
+            return
+        utilities.filesystem.write_atomic(Path(self.directory, name), content)
+        with self.__lock:
+            if self.__disk_bytes is None or self.__disk_bytes + len(content) > self.max_bytes:
+                # Other processes may share the directory, so the disk is recounted whenever the cap looks close.
+                self.__evict()
+            else:
+                self.__disk_bytes += len(content)
+
+
+# The cache icons use unless told otherwise; memory-only until someone gives it a directory.
+shared = DerivativeCache()
@@ -1,53 +1,142 @@
 
 import base64
+import hashlib
 import io 
+import threading
 
 from pathlib import Path
 from PIL import Image
 
+from . import derivatives
+
+
+# Formats we can recognize (and pass through untouched) without asking PIL.
+SIGNATURES = {
+    'png': [b'\x89PNG\r\n\x1a\n'],
+    'jpeg': [b'\xff\xd8\xff'],
+    'gif': [b'GIF87a', b'GIF89a']
+}
+
+EXTENSIONS = {
+    'jpeg': 'jpg'
+}
+
 
 class Icon ():
     """ 
-    A wrapper around a PIL Image corresponding to a character's icon.
+    A character's icon, kept as its original encoded bytes; the PIL Image is only decoded when a pixel operation needs it.
     Scriptmaker only supports a single icon per character, and does not deal in alternate alignments.
     """
     
-    def __init__ (self, id, bytes):
+    def __init__ (self, id, bytes, hash = None, bbox = None):
         """ 
-        Creates an icon from the bytes of a PNG image.
+        Creates an icon from the bytes of an image (usually a PNG). The content hash and content bounding box can be supplied if they are already known.
         """
         self.id = id
-        self.icon = Image.open(io.BytesIO(bytes))
+        self.data = bytes
+        self.hash = hash if hash else hashlib.sha256(bytes).hexdigest()
+        self.bbox = tuple(bbox) if bbox else None
+        self.format = self.__sniff(bytes)
+    
+        self.__image = None
+        self.__lock = threading.Lock()
+    
+        # Anything we don't recognize goes through PIL straight away, so that junk is still rejected at load time.
+        if not self.format:
+            self.format = self.icon.format.lower()
+    
+    
+    @property
+    def icon (self):
+        """ 
+        The decoded PIL Image. Icons are shared by every script (and render thread) using a datastore, so it is decoded once, fully, under a lock; PIL decodes lazily, and not thread-safely, otherwise.
+        """
+        with self.__lock:
+            if self.__image is None:
+                image = Image.open(io.BytesIO(self.data))
+                image.load()
+                self.__image = image
+        return self.__image
     
     
     def base64 (self):
         """ 
-        Provides a b64 encoding of the image data.
+        Provides a b64 encoding of the icon as a PNG; the original bytes are used as they are if they already are one.
         """
+        if self.format == 'png':
+            return base64.b64encode(self.data)
         buffer = io.BytesIO()
         self.icon.save(buffer, format = 'png')
         return base64.b64encode(buffer.getvalue())
     
     
-    def crop (self):
+    def crop (self, cache = None):
         """ 
-        Returns a new icon cropped to content.
+        Returns a new icon cropped to content. Crops are remembered by content hash in the given DerivativeCache (or the shared one).
         """
-        buffer = io.BytesIO()
-        cropped = self.icon.crop(self.icon.getbbox())
-        cropped.save(buffer, format = "png")
-        return Icon(self.id, buffer.getvalue())
+        def __crop ():
+            buffer = io.BytesIO()
+            bbox = self.bbox if self.bbox else self.icon.getbbox()
+            self.icon.crop(bbox).save(buffer, format = "png")
+            return buffer.getvalue()
+        
+        cache = cache if cache else derivatives.shared
+        return Icon(self.id, cache.get(('crop', self.hash), __crop))
+    
+    
+    @property
+    def mime (self):
+        """ 
+        The MIME type of the original image data.
+        """
+        return f"image/{self.format}"
     
     
     def path (self, dirname):
         """ 
-        Hints the save path with the given dirname.
+        Hints the save path with the given dirname; the extension follows the image's actual format.
         """
-        return Path(dirname, f"{self.id}.png")
-
-
+        return Path(dirname, f"{self.id}.{EXTENSIONS.get(self.format, self.format)}")
+    
+    
+    def resized (self, width = None, height = None, cache = None):
+        """ 
+        Returns an icon scaled down to fit within the given pixel bounds (either may be None), or this icon if it already fits.
+        Resizes are remembered by content hash and bounds in the given DerivativeCache (or the shared one).
+        """
+        def __bounds ():
+            return (width if width else self.icon.width, height if height else self.icon.height)
+        
+        def __resize ():
+            image = self.icon.copy()
+            image.thumbnail(__bounds(), Image.Resampling.LANCZOS)
+            buffer = io.BytesIO()
+            image.save(buffer, format = "png", optimize = True)
+            return buffer.getvalue()
+        
+        bounds = __bounds()
+        if self.icon.width <= bounds[0] and self.icon.height <= bounds[1]:
+            return self
+        
+        cache = cache if cache else derivatives.shared
+        return Icon(self.id, cache.get(('resize', self.hash, width, height), __resize))
+    
+    
     def save (self, dirname):
         """ 
-        Saves the image to a path.
+        Saves the original image bytes to a path.
+        """
+        with open(self.path(dirname), 'wb') as icon_file:
+            icon_file.write(self.data)
+    
+    
+    def __sniff (self, bytes):
+        """ 
+        Identifies common image formats from their signatures.
         """
-        self.icon.save(self.path(dirname))
+        for format, signatures in SIGNATURES.items():
+            if any(bytes.startswith(signature) for signature in signatures):
+                return format
+        if bytes[:4] == b'RIFF' and bytes[8:12] == b'WEBP':
+            return 'webp'
+        return None
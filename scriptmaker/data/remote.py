@@ -0,0 +1,112 @@
+from __future__ import annotations
+
+import concurrent.futures
+import threading
+import urllib.parse
+import urllib.request
+
+import scriptmaker.utilities as utilities
+
+
+# Download slots per (host, limit), shared by every Fetcher in the process, since each datastore overlay has a Fetcher of its own.
+host_slots : dict[tuple[str, int], threading.BoundedSemaphore] = {}
+host_slots_lock = threading.Lock()
+
+
+def fetch (url, cache = None, timeout = None):
+    """
+    Downloads the content behind a URL, going through an AssetCache if one is given.
+    """
+    with utilities.profiling.span('fetch.asset'):
+        if cache:
+            content = cache.fetch(url, timeout = timeout)
+        else:
+            with urllib.request.urlopen(url, timeout = timeout) as response:
+                content = response.read()
+    utilities.profiling.count('assets_fetched')
+    utilities.profiling.count('asset_bytes_fetched', len(content))
+    return content
+
+
+class Fetcher ():
+    """
+    Fetches remote assets (icons, logos), either one at a time or as a concurrent batch ahead of use.
+    """
+
+    def __init__ (
+        self, cache = None, *,
+        max_workers = 8, # Concurrent downloads across all hosts
+        per_host = 4, # Concurrent downloads against any single host, across every Fetcher in the process
+        timeout = 60 # Seconds allowed for a whole batch
+    ):
+        """
+        Creates a fetcher; downloads go through the given AssetCache, if any.
+        """
+        self.cache = cache
+        self.max_workers = max_workers
+        self.per_host = per_host
+        self.timeout = timeout
+
+        self.__lock = threading.Lock()
+        self.__results : dict[str, bytes | Exception] = {}
+
+
+    def discard (self):
+        """
+        Forgets the prefetched results, once the batch they were fetched for is done.
+        """
+        with self.__lock:
+            self.__results.clear()
+
+
+    def fetch (self, url):
+        """
+        Returns the content behind a URL, using a prefetched result if there is one; results are kept until discard(), so URLs a batch uses twice are only fetched once.
+        """
+        with self.__lock:
+            result = self.__results.get(url)
+        if result is None:
+            result = self.__fetch_limited(url)
+        if isinstance(result, Exception):
+            raise result
+        return result
+
+
+    def prefetch (self, urls):
+        """
+        Downloads a batch of URLs concurrently, holding the results (or errors) for later calls to fetch().
+        """
+        urls = list(dict.fromkeys(url for url in urls if url))
+        if len(urls) == 0:
+            return
+
+        executor = concurrent.futures.ThreadPoolExecutor(max_workers = min(self.max_workers, len(urls)))
+        try:
+            with utilities.profiling.span('fetch.prefetch'):
+                futures = { executor.submit(self.__fetch_limited, url): url for url in urls }
+                done, pending = concurrent.futures.wait(futures, timeout = self.timeout)
+
+            with self.__lock:
+                for future in done:
+                    self.__results[futures[future]] = future.result()
+                for future in pending:
+                    self.__results[futures[future]] = TimeoutError(f"timed out after {self.timeout}s fetching '{futures[future]}'")
+        finally:
+            executor.shutdown(wait = False, cancel_futures = True)
+
+
+    def __fetch_limited (self, url):
+        """
+        Fetches a URL while holding one of its host's slots (shared across fetchers); failures are returned rather than raised.
+        """
+        key = (urllib.parse.urlsplit(url).netloc, self.per_host)
+        with host_slots_lock:
+            if key not in host_slots:
+                host_slots[key] = threading.BoundedSemaphore(self.per_host)
+            slot = host_slots[key]
+
+        try:
+            with slot:
+                return fetch(url, cache = self.cache, timeout = self.timeout)
+        except Exception as err:
+            return err
@@ -0,0 +1,85 @@
+from __future__ import annotations
+
+import hashlib
+import io
+import json
+import pickle
+
+from pathlib import Path
+from PIL import Image
+
+from . import compiled, icons
+
+import scriptmaker.models as models
+
+
+SNAPSHOT_FILE = "catalogue.pickle"
+
+# Bump whenever the snapshot's layout or Character's attributes change, so that old snapshots are treated as stale.
+SNAPSHOT_VERSION = 3
+
+
+def sources_digest ():
+    """
+    Hashes the compiled JSON that a snapshot is derived from.
+    """
+    digest = hashlib.sha256()
+    for file in ["official.json", "nightmeta.json"]:
+        digest.update(compiled.get_data(file))
+    return digest.hexdigest()
+
+
+def build ():
+    """
+    Validates every compiled character and captures its state, along with the derived fields renderers need (formatted text, icon hashes and crop boxes).
+    """
+    snapshot = {
+        "version": SNAPSHOT_VERSION,
+        "sources": sources_digest(),
+        "official": {},
+        "nightmeta": {},
+        "icons": {}
+    }
+
+    for group in ["official", "nightmeta"]:
+        entries = json.loads(compiled.get_data(f"{group}.json"))
+        for _, entry in entries.items():
+            if group == "official":
+                entry = dict(entry, image = 'local-icon')
+            character = models.Character.from_dict(entry)
+            character.markup # Precompute the formatted ability and reminders.
+            snapshot[group][character.id] = dict(vars(character))
+
+            icon_data = icons.get_data(f"Icon_{character.id}.png")
+            snapshot["icons"][character.id] = {
+                "hash": hashlib.sha256(icon_data).hexdigest(),
+                "bbox": Image.open(io.BytesIO(icon_data)).getbbox() # Where tokens crop the icon to
+            }
+
+    return snapshot
+
+
+def write (path = None):
+    """
+    Writes a fresh snapshot next to the compiled JSON, or to the given path.
+    """
+    path = path if path else Path(Path(compiled.__file__).parent, SNAPSHOT_FILE)
+    with open(path, "wb") as snapshot_file:
+        pickle.dump(build(), snapshot_file, protocol = pickle.HIGHEST_PROTOCOL)
+    return path
+
+
+def load ():
+    """
+    Loads the packaged snapshot, or returns None if it is missing, unreadable or stale.
+    """
+    try:
+        snapshot = pickle.loads(compiled.get_data(SNAPSHOT_FILE))
+    except Exception:
+        return None
+
+    if not isinstance(snapshot, dict) or snapshot.get("version") != SNAPSHOT_VERSION:
+        return None
+    if snapshot.get("sources") != sources_digest():
+        return None
+    return snapshot
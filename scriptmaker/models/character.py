@@ -29,6 +29,8 @@ class Character ():
         It is *highly* recommended that you create characters using one of the class methods.
         """
         self.__warnings = [] # Anything not worthy of an actual exception is stored as a message.
+        self.__markup = None # Render-ready text, built on first use.
+        self.__markup_source = None # The raw text that markup was built from.
         
         try:
             self.__set_mandatory_properties(id, name, team, ability, image)
@@ -45,6 +47,23 @@ class Character ():
         Returns the warnings produced for this character at creation.
         """
         return self.__warnings
+    
+    
+    @property
+    def markup (self):
+        """
+        The ability and nightorder reminders of this character, formatted for rendering; missing (null) reminders format as "".
+        Built once, and again only if the raw text changes; the raw text itself is never touched.
+        """
+        source = (self.ability, self.nightinfo['first']['reminder'], self.nightinfo['other']['reminder'])
+        if self.__markup is None or self.__markup_source != source:
+            self.__markup_source = source
+            self.__markup = {
+                'ability': utilities.markup.ability(self.ability),
+                'first': utilities.markup.reminder(self.nightinfo['first']['reminder'] or ""),
+                'other': utilities.markup.reminder(self.nightinfo['other']['reminder'] or "")
+            }
+        return self.__markup
 
         
     @classmethod
@@ -56,6 +75,16 @@ class Character ():
         return cls(** prepared_arguments)
     
     
+    @classmethod
+    def from_snapshot (cls, state):
+        """
+        Restores a character from the state of one that was already validated, e.g. by a catalogue snapshot.
+        """
+        character = cls.__new__(cls)
+        character.__dict__.update(state)
+        return character
+    
+    
     @classmethod
     def from_json (cls, character_json):
         """
@@ -1,8 +1,7 @@
 from __future__ import annotations
 
-import io
-import tempfile
-import urllib.request
+import hashlib
+import json
 
 import scriptmaker.constants as constants
 import scriptmaker.data as data
@@ -26,20 +25,19 @@ class ScriptMeta ():
         self.add_logo(logo)
         
         
-    def add_logo (self, logo):
+    def add_logo (self, logo, fetcher = None):
         """ 
-        Tries to set a logo.
+        Tries to set a logo, fetching it through the given Fetcher (or AssetCache) if there is one.
         """
         self.logo = logo
         self.icon = None
         
         if self.logo:
             try: 
-                with tempfile.NamedTemporaryFile() as tmpfile:
-                    urllib.request.urlretrieve(self.logo, tmpfile.name)
-                    self.icon = data.Icon('script_logo', tmpfile.read())
-            except utilities.ScriptmakerError as prev:
-                raise utilities.ScriptmakerDataError(f"failed to load script logo from '{self.logo}'")
+                fetcher = fetcher if fetcher else data.remote.Fetcher()
+                self.icon = data.Icon('script_logo', fetcher.fetch(self.logo))
+            except Exception as prev:
+                raise data.ScriptmakerDataError(f"failed to load script logo from '{self.logo}'") from prev
         else:
             self.icon = None
 
@@ -54,7 +52,9 @@ class ScriptOptions ():
         bucket = False,
         simple_nightorder = False, # if True, creates a script with rotatable nightorder
         i18n_fallback = False, # if True, uses an internationally-friendly font for titles and character name
-        force_jinxes = False
+        force_jinxes = False,
+        target = 'screen', # one of constants.OUTPUT_TARGETS; 'print' keeps full-quality images
+        fonts = None # one of constants.FONT_POLICIES, or None for the target's default
     ):
         """
         Creates a set of options for generating a script.
@@ -63,6 +63,8 @@ class ScriptOptions ():
         self.simple_nightorder = simple_nightorder
         self.i18n_fallback = i18n_fallback
         self.force_jinxes = force_jinxes
+        self.target = target
+        self.fonts = fonts
         
 
 class Script ():
@@ -86,6 +88,7 @@ class Script ():
         
         self.by_team : dict[str, list[models.Character]] = {}
         self.characters : list[models.Character] = []
+        self.nightmeta : list[models.Character] = [] # Dusk, dawn, etc.; kept apart from the script's own characters
         self.jinxes : dict[str, list[models.Jinx]] = {}
         self.nightorder : dict[str, list[str]] = {}
         self.nights = nights
@@ -100,13 +103,48 @@ class Script ():
         self.characters.append(self.data.get_character(id))
     
     
+    def asset_ids (self):
+        """
+        Lists the ids whose icons a render of this script actually uses: its characters, their jinx partners, nightmeta and the nightorder.
+        Only meaningful once the script has been finalized.
+        """
+        ids = [ character.id for character in self.characters + self.nightmeta ]
+        for jinxes in self.jinxes.values():
+            ids += [ id for jinx in jinxes for id in (jinx.src_id, jinx.dst_id) ]
+        for night in self.nightorder.values():
+            ids += night
+        return list(dict.fromkeys(ids))
+    
+    
+    def fingerprint (self):
+        """
+        Hashes everything a render of this script depends on, so that cosmetically different scripts (entry order across teams, id spelling) match.
+        Covers the characters' content and icons, meta, options and the scriptmaker version; only meaningful once the script has been finalized.
+        """
+        def __content (character):
+            return { key: value for key, value in vars(character).items() if not key.startswith('_') and key != 'image' }
+        
+        canonical = {
+            "teams": { team: [ __content(character) for character in members ] for team, members in self.by_team.items() },
+            "nightmeta": [ __content(character) for character in self.nightmeta ],
+            "jinxes": { id: [ vars(jinx) for jinx in jinxes ] for id, jinxes in sorted(self.jinxes.items()) },
+            "nightorder": self.nightorder,
+            "icons": { id: self.data.get_icon(id).hash for id in sorted(self.asset_ids()) if self.data.has_character(id) },
+            "meta": { "name": self.meta.name, "author": self.meta.author, "logo": self.meta.icon.hash if self.meta.icon else None },
+            "options": vars(self.options),
+            "version": [utilities.package.version(), data.snapshot.sources_digest()]
+        }
+        return hashlib.sha256(json.dumps(canonical, sort_keys = True, default = str).encode()).hexdigest()
+    
+    
     def finalize (self):
         """
         Calculates jinxes and nightorder for the script. Must be called prior to being used by any renderer.
         """
-        self.__partition_by_teams()
-        self.__calculate_jinxes()
-        self.__calculate_nightorder()
+        with utilities.profiling.span('script.finalize'):
+            self.__partition_by_teams()
+            self.__calculate_jinxes()
+            self.__calculate_nightorder()
 
     
     def remove (self, id):
@@ -145,16 +183,15 @@ class Script ():
             Calculates the night order for a given night.
             """
             if not self.nights:
-                acting_characters = [character for character in self.characters if character.nightinfo[night]['acts']]
+                acting_characters = [character for character in self.characters + self.nightmeta if character.nightinfo[night]['acts']]
                 in_order = sorted(acting_characters, key=lambda character: character.nightinfo[night]['position'])
                 return [ character.id for character in in_order ]
             else:
                 # Just trust it, honestly...
                 return self.nights[night]
             
-        for nightmeta in constants.NIGHT_META:
-            if nightmeta not in [ character.id for character in self.characters ]:
-                self.characters.append(self.data.get_character(nightmeta))
+        script_ids = [ character.id for character in self.characters ]
+        self.nightmeta = [ self.data.get_character(id) for id in constants.NIGHT_META if id not in script_ids ]
 
         self.nightorder = {
             "first": __nightorder_for('first'),
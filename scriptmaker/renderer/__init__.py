@@ -1,3 +1,5 @@
-
+from . import backgrounds, fetcher, resources, results, store, templating
 from .renderer import Renderer
+from .results import DirectoryStorage, MemoryStorage, RenderCache
+from .store import BuildStore
 from .tokenizer import Tokenizer
\ No newline at end of file
@@ -0,0 +1,75 @@
+from __future__ import annotations
+
+import functools
+import hashlib
+import io
+import math
+
+from pathlib import Path
+from PIL import Image
+
+import scriptmaker.constants as constants
+import scriptmaker.data as data
+import scriptmaker.utilities as utilities
+
+
+# Script and nightorder pages are US letter, in inches.
+LETTER = (8.5, 11.)
+
+# JPEG variants are re-encoded at this quality, without chroma subsampling; weasyprint then embeds them as they are.
+# Other formats (PNG, and the WebP token leaves) are re-encoded losslessly.
+JPEG_QUALITY = 92
+
+
+class Background ():
+    """
+    A packaged background image, prepared for an output target.
+    """
+
+    def __init__ (self, name, content, mime):
+        """
+        Wraps a prepared background; name is where it is staged or served, relative to the build folder or virtual root.
+        """
+        self.name = name
+        self.content = content
+        self.mime = mime
+        self.hash = hashlib.sha256(content).hexdigest()
+
+
+@functools.lru_cache(maxsize = None)
+def variant (get_data, file, width, height, target):
+    """
+    Returns a packaged background (read with the given get_data, e.g. templates.get_data), downsampled to just cover width x height inches at the target's background dpi.
+    JPEGs are re-encoded progressively at a high quality; everything else losslessly. Sources that are already small enough, or that a variant wouldn't shrink, are left as they are.
+    Variants are named for the format they actually hold, and remembered in the shared DerivativeCache, and per process.
+    """
+    if target not in constants.OUTPUT_TARGETS:
+        raise utilities.ScriptmakerValueError(f"expected one of [{', '.join(constants.OUTPUT_TARGETS)}], but received {target}")
+
+    source = get_data(file)
+    image = Image.open(io.BytesIO(source))
+    mime = Image.MIME[image.format]
+    extension = f".{data.icon.EXTENSIONS.get(image.format.lower(), image.format.lower())}"
+    dpi = constants.OUTPUT_TARGETS[target]['background_dpi']
+
+    # Backgrounds are drawn to cover their box, so both dimensions must reach it.
+    scale = max(width * dpi / image.width, height * dpi / image.height)
+    if scale >= 1:
+        return Background(file if Path(file).suffix == extension else f"backgrounds/{Path(file).stem}{extension}", source, mime)
+    size = (math.ceil(image.width * scale), math.ceil(image.height * scale))
+
+    def __downsample ():
+        # JPEGs can decode straight to a smaller scale, which is much cheaper than decoding in full.
+        image.draft(image.mode, size)
+        resized = image.resize(size, Image.Resampling.LANCZOS)
+        buffer = io.BytesIO()
+        if image.format == 'JPEG':
+            resized.save(buffer, format = 'JPEG', quality = JPEG_QUALITY, subsampling = 0, optimize = True, progressive = True)
+        elif image.format == 'WEBP':
+            resized.save(buffer, format = 'WEBP', lossless = True)
+        else:
+            resized.save(buffer, format = image.format, optimize = True)
+        return buffer.getvalue() if buffer.tell() < len(source) else source
+
+    content = data.derivatives.shared.get(('background', hashlib.sha256(source).hexdigest(), size, JPEG_QUALITY), __downsample)
+    return Background(f"backgrounds/{Path(file).stem}-{dpi}dpi{extension}", content, mime)
@@ -0,0 +1,69 @@
+from __future__ import annotations
+
+import functools
+import mimetypes
+import urllib.parse
+import weasyprint
+
+import scriptmaker.templates as templates
+
+
+# Where in-memory renders pretend their assets live; .invalid can never resolve, so nothing leaks onto the network.
+VIRTUAL_ROOT = "http://scriptmaker.invalid/"
+
+
+@functools.lru_cache(maxsize = None)
+def packaged (file):
+    """
+    Reads a packaged template file (stylesheet, font, background) once per process.
+    """
+    return templates.get_data(file)
+
+
+def virtual_url (name):
+    """
+    The virtual URL for a (relative) name.
+    """
+    return urllib.parse.urljoin(VIRTUAL_ROOT, urllib.parse.quote(name))
+
+
+class VirtualFetcher ():
+    """
+    A weasyprint url_fetcher that serves a render's assets from memory under VIRTUAL_ROOT: anything added to it, then packaged template files.
+    Every other URL goes to weasyprint's default fetcher, unless external URLs are refused.
+    """
+
+    def __init__ (self, *, allow_external = True):
+        """
+        Creates a fetcher with no assets of its own. Without allow_external, any URL outside VIRTUAL_ROOT (a remote host, a local file) is refused rather than fetched.
+        """
+        self.allow_external = allow_external
+        self.__assets : dict[str, tuple[bytes, str]] = {}
+
+
+    def add (self, name, content, mime_type = None):
+        """
+        Serves some bytes under a (relative) name, returning its virtual URL.
+        """
+        self.__assets[name] = (content, mime_type if mime_type else mimetypes.guess_type(name)[0])
+        return virtual_url(name)
+
+
+    def __call__ (self, url, timeout = 10, ssl_context = None):
+        if not url.startswith(VIRTUAL_ROOT):
+            if not self.allow_external:
+                raise ValueError(f"refusing to fetch '{url}'; only in-memory assets are allowed")
+            return weasyprint.default_url_fetcher(url, timeout = timeout, ssl_context = ssl_context)
+
+        name = urllib.parse.unquote(urllib.parse.urlsplit(url).path).lstrip('/')
+        if name in self.__assets:
+            content, mime_type = self.__assets[name]
+        elif '..' in name.split('/'):
+            raise ValueError(f"no in-memory asset for '{url}'")
+        else:
+            try:
+                content, mime_type = packaged(name), mimetypes.guess_type(name)[0]
+            except OSError as prev:
+                raise ValueError(f"no in-memory asset for '{url}'") from prev
+
+        return { "string": content, "mime_type": mime_type, "redirected_url": url }
@@ -1,12 +1,11 @@
 from __future__ import annotations
 
+import io
 import json
+import math
 import pkgutil
-import re
 import tempfile
-import weasyprint
 
-from jinja2 import Environment, FileSystemLoader
 from pathlib import Path
 from queue import SimpleQueue
 
@@ -16,87 +15,90 @@ import scriptmaker.models as models
 import scriptmaker.templates as templates 
 import scriptmaker.utilities as utilities
 
+from . import backgrounds, fetcher, resources, store, templating
+
+# How large (in CSS px) each template draws character icons and the script logo; icons are sized from these per output target.
+ICON_SIZES = {
+    "script.jinja": { "icon": 44, "logo": 60 },
+    "nights.jinja": { "icon": 32, "logo": 60 }
+}
+
 
 class Renderer ():
     """ 
     A script-to-PDF renderer.
     """
-      
+    
+    def __init__ (self, *, in_memory = False, cache = None, debug_html = False, trusted = True):
+        """
+        Creates a renderer. In memory, assets are served to weasyprint straight from the datastore and package, and only the PDF is written.
+        A renderer keeps its parsed stylesheets, fonts and decoded images between renders, so reuse one instance for many scripts.
+        With a RenderCache, scripts that have been rendered before are copied out of the cache instead.
+        With debug_html, the HTML handed to weasyprint is also saved into the build folder, for introspection.
+        Scripts that aren't trusted (e.g. from a network request) always render in memory, and weasyprint may only read their own assets; any other URL their markup names is refused, not fetched.
+        """
+        self.in_memory = in_memory
+        self.cache = cache
+        self.debug_html = debug_html
+        self.trusted = trusted
+        self.resources = resources.RenderResources()
+    
+    
+    def warm_up (self):
+        """ 
+        Parses every stylesheet and loads their fonts now, and prepares each target's background, rather than during the first render.
+        """
+        for style in ["common.css", "script.css", "nights.css"]:
+            self.resources.stylesheet(style)
+        for target in constants.OUTPUT_TARGETS:
+            backgrounds.variant(templates.get_data, "parchment.jpg", *backgrounds.LETTER, target)
+        return self
+    
+    
+    def nightorder_path (self, script, *, output_folder = None):
+        """
+        Where render_nightorder writes a script's nightorder, given the same output_folder.
+        """
+        output_folder = Path(output_folder, 'pdf') if output_folder else Path(script.data.workspace, "pdf")
+        nights_style = 'nights-simple' if script.options.simple_nightorder else 'nights-full'
+        return Path(output_folder, f"{utilities.sanitize.name(script.meta.name)}-{nights_style}.pdf")
+    
+    
+    def script_path (self, script, *, output_folder = None):
+        """
+        Where render_script writes a script, given the same output_folder.
+        """
+        output_folder = Path(output_folder, 'pdf') if output_folder else Path(script.data.workspace, "pdf")
+        return Path(output_folder, f"{utilities.sanitize.name(script.meta.name)}-script.pdf")
+    
+    
     def render_script (
         self, script : models.Script, *,
-        output_folder = None
+        output_folder = None,
+        build_folder = None,
+        stream = None
     ):
         """
         Renders the script PDF, returning the path to the file.
+        Assets are staged in build_folder, or the build folder beside the pdf folder; give scripts that share an output folder their own if they render at once.
+        Given a writable binary stream instead, writes the PDF to it without touching any folders, and returns the stream.
         """
         script.finalize()
         
-        output_folder = Path(output_folder, 'pdf') if output_folder else Path(script.data.workspace, "pdf")
-        utilities.filesystem.mkdirp(output_folder.parent)
-        utilities.filesystem.mkdirp(output_folder)
-        
-        # We are going to calculate some layouts, so we're gonna need a few numbers.
-        ppi = 144.
-        page_w, page_h = ppi * 8.5, ppi * 11. 
-        page_padding = 0.02
-        page_content = (1 - 2 * page_padding)
-        header = 60.
-        content_w, content_h = page_content * page_w, page_content * page_h - header
-        column_gap = 0.02
-        icon_size = 45.
-        character_overflow = 15
-        character_trailing = 30.
-        character_w, character_h = (1. - column_gap) / 2. * content_w, icon_size + character_overflow
-        jinx_w, jinx_h = content_w, 30.
-        
-        # Calculate the height of each section.
-        heights = {}
-        for team in constants.TEAMS:
-            if team not in script.by_team: heights[team] = 0. 
-            else:
-                members = len(script.by_team[team])
-                height = character_trailing + character_h * int((members + 1) / 2)
-                heights[team] = height
-        heights["jinxes"] = jinx_h * sum([ len(jinxes) for id, jinxes in script.jinxes.items() ])
+        # Repeat renders of the same script come straight from the cache.
+        output = stream if stream is not None else self.script_path(script, output_folder = output_folder)
+        cache_key = self.cache.key('script', script) if self.cache else None
+        if self.__restore(cache_key, output):
+            return output
         
-        # Separate out teams into page groups (including jinxes as a team). Follow a cramming heuristic.
-        to_add = SimpleQueue()
-        for team in script.by_team:
-            if len(script.by_team[team]) > 0:
-                to_add.put(team)
-    
-        # If we want jinxes to flow, we should try to cram it too.
-        if not script.options.force_jinxes:
-            to_add.put('jinxes')
-        
-        page_groups = [{ "teams": [], "height": 0 }]
-        
-        while not to_add.empty():
-            next_team = to_add.get()
-            cumulative = page_groups[-1]['height']
-            current_height = heights[next_team]
-            # If the current page is empty, don't skip it just because the current group is too big.
-            if cumulative == 0 or cumulative + current_height < content_h:
-                page_groups[-1]['teams'].append(next_team)
-                page_groups[-1]['height'] += current_height
-            else:
-                page_groups.append({ "teams": [next_team], "height": current_height })
-
-        # If we always want jinxes on a new page
-        if script.options.force_jinxes:
-            page_groups.append({ "teams": ["jinxes"], "height": 0 })
-        
-        jinxes_next_page = len(page_groups[-1]["teams"]) == 1 or script.options.force_jinxes
-        if jinxes_next_page:
-            page_groups.pop()
-
-        # Decide where we'll build icons.
-        workspace = output_folder
+        # Cram teams (and jinxes) onto pages.
+        with utilities.profiling.span('render.layout'):
+            page_groups, jinxes_next_page = self.__page_groups(script)
 
         # Bold the ability text.
         abilities = {}
         for character in script.characters:
-            abilities[character.id] = re.sub(r'(?P<setup>\[.*\])', '<b>\g<setup></b>', character.ability)
+            abilities[character.id] = character.markup['ability']
 
         # Calculate spacers for small team names.
         needs_spacers = { team: len(script.by_team[team]) == 1 for team in script.by_team }
@@ -120,122 +122,308 @@ class Renderer ():
             if len(script.by_team[team]) == 2:
                 spacers[team] = 1
 
-        # Pass configuration forwards to jinja/weasyprint stack.  
+        # Size the images for the output target.
+        with utilities.profiling.span('render.images'):
+            icons, logo, background = self.__sized_images(script, "script.jinja")
+
+        # Pass configuration forwards to jinja/weasyprint stack; icon and logo URLs are filled in as they are staged.
         params = {
             "pages": [ group['teams'] for group in page_groups ],
             "characters": { character.id: character for character in script.characters },
             "abilities": abilities,
             "spacers": spacers,
             "teams": script.by_team,
-            "icons": { id: f"file://{icon.path(Path(workspace.parent, 'build', 'icons').resolve())}" for id, icon in script.data.icons.items() },
-            "logo": f"file://{script.meta.icon.path(Path(workspace.parent, 'build').resolve())}" if script.meta.icon else "",
             "jinxes": script.jinxes,
             "has_jinxes": sum([ len(jinxes) for id, jinxes in script.jinxes.items() ]) > 0,
             "jinxes_next_page": jinxes_next_page,
             "meta": script.meta,
             "options": script.options
         }
-        output_path = Path(output_folder, f"{utilities.sanitize.name(script.meta.name)}-script.pdf")  
-        
-        return self.__render_jinja(
-            workspace = workspace,
+        content = self.__render_jinja(
+            output = output,
+            build_folder = build_folder,
             template = "script.jinja",
             style = "script.css",
-            icons = script.data.icons.values(),
-            logo = script.meta.icon,
+            icons = icons,
+            logo = logo,
+            background = background,
             params = params,
-            output_file = output_path
+            full_fonts = self.__full_fonts(script)
         )
+        return self.__deliver(cache_key, content, output)
+    
+    
+    def render_script_bytes (self, script : models.Script):
+        """
+        Renders the script PDF, returning its content.
+        """
+        return self.render_script(script, stream = io.BytesIO()).getvalue()
         
         
     def render_nightorder (
         self, script : models.Script, *, 
-        output_folder = None
+        output_folder = None,
+        build_folder = None,
+        stream = None
     ):
         """
         Renders the nightorder PDF, returning the file path.
+        Assets are staged as in render_script.
+        Given a writable binary stream instead, writes the PDF to it without touching any folders, and returns the stream.
         """
         script.finalize()
         
-        output_folder = Path(output_folder, 'pdf') if output_folder else Path(script.data.workspace, "pdf")
-        utilities.filesystem.mkdirp(output_folder.parent)
-        utilities.filesystem.mkdirp(output_folder)
+        # Repeat renders of the same script come straight from the cache.
+        output = stream if stream is not None else self.nightorder_path(script, output_folder = output_folder)
+        cache_key = self.cache.key('nightorder', script) if self.cache else None
+        if self.__restore(cache_key, output):
+            return output
         
-        workspace = output_folder
+        characters = script.characters + script.nightmeta
+        with utilities.profiling.span('render.images'):
+            icons, logo, background = self.__sized_images(script, "nights.jinja")
         
-        # Sanitize reminder text.
-        for character in script.characters:
-            for night in ['first', 'other']:
-                info = character.nightinfo[night]
-                if 'reminder' not in info:
-                    continue
-                character.nightinfo[night]['reminder'] = re.sub(r'\*(?P<bold>[A-Za-z\s-]+)\*', '<b>\g<bold></b>', character.nightinfo[night]['reminder'])
-                character.nightinfo[night]['reminder'] = re.sub(r' :reminder:', '', character.nightinfo[night]['reminder'])
-        
-        # Pass configuration forwards to jinja/weasyprint stack.  
+        # Pass configuration forwards to jinja/weasyprint stack; reminders are formatted copies, so shared characters are never rewritten.
+        # Icon and logo URLs are filled in as they are staged.
         params = {  
-            "characters": { character.id: character for character in script.characters },
-            "icons": { id: f"file://{icon.path(Path(workspace.parent, 'build', 'icons').resolve())}" for id, icon in script.data.icons.items() },
-            "logo": f"file://{script.meta.icon.path(Path(workspace.parent, 'build').resolve())}" if script.meta.icon else "",
+            "characters": { character.id: character for character in characters },
+            "reminders": { character.id: character.markup for character in characters },
             "nightorder": script.nightorder,
             "meta": script.meta,
             "options": script.options
         }
         
-        nights_style = 'nights-simple' if script.options.simple_nightorder else 'nights-full'
-        output_path = Path(output_folder, f"{utilities.sanitize.name(script.meta.name)}-{nights_style}.pdf")
-        
-        return self.__render_jinja(
-            workspace = workspace,
+        content = self.__render_jinja(
+            output = output,
+            build_folder = build_folder,
             template = "nights.jinja",
             style = "nights.css",
-            icons = script.data.icons.values(),
-            logo = script.meta.icon,
+            icons = icons,
+            logo = logo,
+            background = background,
             params = params,
-            output_file = output_path
+            full_fonts = self.__full_fonts(script)
         )
+        return self.__deliver(cache_key, content, output)
     
     
-    def __render_jinja (self, *, workspace, template, style, icons, logo, params, output_file):
+    def render_nightorder_bytes (self, script : models.Script):
         """
-        Renders a jinja template (in the templates directory) and converts to PDF.
+        Renders the nightorder PDF, returning its content.
         """
-        tmpdir = Path(workspace.parent, 'build')
-        utilities.filesystem.mkdirp(tmpdir)
+        return self.render_nightorder(script, stream = io.BytesIO()).getvalue()
+    
+    
+    def __deliver (self, cache_key, content, output):
+        """
+        Writes a fresh render to its output (a path or a stream), remembering it in the cache if there is one.
+        """
+        if cache_key:
+            self.cache.put(cache_key, content)
+        with utilities.profiling.span('render.write'):
+            if isinstance(output, Path):
+                utilities.filesystem.mkdirp(output.parent)
+                utilities.filesystem.write_atomic(output, content)
+            else:
+                output.write(content)
+        utilities.profiling.count('pdf_bytes_written', len(content))
+        return output
+    
+    
+    def __restore (self, cache_key, output):
+        """
+        Writes a cached render to its output (a path or a stream), returning whether there was one.
+        """
+        if not cache_key:
+            return False
+        if isinstance(output, Path):
+            utilities.filesystem.mkdirp(output.parent)
+            return self.cache.restore(cache_key, output)
+        content = self.cache.get(cache_key)
+        if content is not None:
+            output.write(content)
+        return content is not None
+    
+    
+    def __page_groups (self, script):
+        """
+        Groups the script's teams (and jinxes) into pages, following a cramming heuristic; returns the groups, and whether jinxes start a page of their own.
+        """
+        # We are going to calculate some layouts, so we're gonna need a few numbers.
+        ppi = 144.
+        page_w, page_h = ppi * 8.5, ppi * 11. 
+        page_padding = 0.02
+        page_content = (1 - 2 * page_padding)
+        header = 60.
+        content_w, content_h = page_content * page_w, page_content * page_h - header
+        column_gap = 0.02
+        icon_size = 45.
+        character_overflow = 15
+        character_trailing = 30.
+        character_w, character_h = (1. - column_gap) / 2. * content_w, icon_size + character_overflow
+        jinx_w, jinx_h = content_w, 30.
+        
+        # Calculate the height of each section.
+        heights = {}
+        for team in constants.TEAMS:
+            if team not in script.by_team: heights[team] = 0. 
+            else:
+                members = len(script.by_team[team])
+                height = character_trailing + character_h * int((members + 1) / 2)
+                heights[team] = height
+        heights["jinxes"] = jinx_h * sum([ len(jinxes) for id, jinxes in script.jinxes.items() ])
+        
+        # Separate out teams into page groups (including jinxes as a team). Follow a cramming heuristic.
+        to_add = SimpleQueue()
+        for team in script.by_team:
+            if len(script.by_team[team]) > 0:
+                to_add.put(team)
+
+        # If we want jinxes to flow, we should try to cram it too.
+        if not script.options.force_jinxes:
+            to_add.put('jinxes')
+        
+        page_groups = [{ "teams": [], "height": 0 }]
+        
+        while not to_add.empty():
+            next_team = to_add.get()
+            cumulative = page_groups[-1]['height']
+            current_height = heights[next_team]
+            # If the current page is empty, don't skip it just because the current group is too big.
+            if cumulative == 0 or cumulative + current_height < content_h:
+                page_groups[-1]['teams'].append(next_team)
+                page_groups[-1]['height'] += current_height
+            else:
+                page_groups.append({ "teams": [next_team], "height": current_height })
+
+        # If we always want jinxes on a new page
+        if script.options.force_jinxes:
+            page_groups.append({ "teams": ["jinxes"], "height": 0 })
+        
+        jinxes_next_page = len(page_groups[-1]["teams"]) == 1 or script.options.force_jinxes
+        if jinxes_next_page:
+            page_groups.pop()
+
+        return page_groups, jinxes_next_page
+    
+    
+    def __render_jinja (self, *, output, build_folder, template, style, icons, logo, background, params, full_fonts):
+        """
+        Renders a jinja template (in the templates directory) and converts to PDF, returning its content.
+        Renders to a path stage their assets in the build folder (unless in memory); renders to a stream have no folders, so are always in memory.
+        """
+        tmpdir = self.__build_folder(output, build_folder)
         
-        # Load the jinja templates, CSS and fonts into our tmpdir, so we can pretend it's an environment.
-        for file in templates.COMMON + [template, style]:
-            file_content = templates.get_data(file)
-            with open(Path(tmpdir, file), "wb") as tmpfile:
-                tmpfile.write(file_content)
+        if self.in_memory or not self.trusted or tmpdir is None:
+            return self.__render_in_memory(output = output, build_folder = build_folder, template = template, style = style, icons = icons, logo = logo, background = background, params = params, full_fonts = full_fonts)
         
-        # Load the icons so the script can reference them.
-        utilities.filesystem.mkdirp(Path(tmpdir, 'icons'))
-        for icon in icons:
-            icon.save(Path(tmpdir, 'icons'))
+        with utilities.profiling.span('render.stage'):
+            icons_dir = Path(tmpdir, 'icons', Path(template).stem).resolve()
+            utilities.filesystem.mkdirp(tmpdir)
         
-        # Save the logo.
-        if logo:
-            logo.save(tmpdir)
+            # Link the CSS, fonts and backgrounds into our tmpdir, so the build folder can be opened on its own.
+            for file in templates.COMMON + [style]:
+                store.shared.stage_packaged(templates.get_data, file, tmpdir)
         
-        # Process the corresponding jinja template.
-        loader = FileSystemLoader(tmpdir)
-        env = Environment(loader = loader, extensions=['jinja2.ext.loopcontrols'])
-        html = env.get_template(template).render(params)
+            # Link the icons so the script can reference them; each template gets its own folder, since each sizes icons differently.
+            # Anything that had to be relinked has changed, so its decoded image is stale.
+            params = dict(params, icons = {}, logo = "")
+            for id, icon in icons.items():
+                params['icons'][id] = f"file://{icon.path(icons_dir)}"
+                if store.shared.stage(icon.data, icon.path(icons_dir), icon.hash):
+                    self.resources.evict(params['icons'][id])
         
-        # Save the HTML for build introspection.
-        with open(Path(tmpdir, output_file.stem).with_suffix('.html'), 'w') as html_file:
-            html_file.write(html)
+            # Link the logo.
+            if logo:
+                params['logo'] = f"file://{logo.path(tmpdir.resolve())}"
+                if store.shared.stage(logo.data, logo.path(tmpdir), logo.hash):
+                    self.resources.evict(params['logo'])
+        
+            # Link the page background prepared for this target.
+            params['background'] = f"file://{Path(tmpdir, background.name).resolve()}"
+            if store.shared.stage(background.content, Path(tmpdir, background.name), background.hash):
+                self.resources.evict(params['background'])
         
-        # Make sure there's an output directory.
-        utilities.filesystem.mkdirp(Path(output_file).parent)
+        # Process the corresponding jinja template; the shared environment only compiles it once.
+        with utilities.profiling.span('render.jinja'):
+            html = templating.shared.get_template(template).render(params)
         
-        # Render the HTML out as full-quality PDF to the given location.
-        weasyprint.HTML(string = html).write_pdf(
-            target = output_file,
-            stylesheets = [Path(tmpdir, style), Path(tmpdir, "common.css")],
-            jpeg_quality = 95,
-            full_fonts = True
+        # Save the HTML for build introspection, if asked to.
+        self.__save_html(output, build_folder, html)
+        
+        # Render the HTML out as full-quality PDF; packaged assets still come from memory.
+        return self.resources.write_pdf(html, [style, "common.css"], fetcher.VirtualFetcher(), full_fonts = full_fonts)
+    
+    
+    def __render_in_memory (self, *, output, build_folder, template, style, icons, logo, background, params, full_fonts):
+        """
+        Renders a jinja template to PDF without staging anything on disk; weasyprint reads every asset through a VirtualFetcher.
+        Images are named by content hash, so their decoded forms can be reused across renders.
+        """
+        assets = fetcher.VirtualFetcher(allow_external = self.trusted)
+        params = dict(params,
+            icons = { id: assets.add(f"images/{icon.path(icon.hash).name}", icon.data, icon.mime) for id, icon in icons.items() },
+            logo = assets.add(f"images/{logo.path(logo.hash).name}", logo.data, logo.mime) if logo else "",
+            background = assets.add(background.name, background.content, background.mime)
         )
         
-        return output_file
\ No newline at end of file
+        with utilities.profiling.span('render.jinja'):
+            html = templating.shared.get_template(template).render(params)
+        self.__save_html(output, build_folder, html)
+        
+        return self.resources.write_pdf(html, [style, "common.css"], assets, full_fonts = full_fonts)
+    
+    
+    def __build_folder (self, output, build_folder):
+        """
+        Where a render to an output path stages its assets: the given build folder, or the one beside its pdf folder. Renders to a stream have none.
+        """
+        if not isinstance(output, Path):
+            return None
+        return Path(build_folder) if build_folder else Path(output.parent.parent, 'build')
+    
+    
+    def __save_html (self, output, build_folder, html):
+        """
+        With debug_html, saves a render's HTML into its build folder; renders to a stream have nowhere to save it.
+        """
+        tmpdir = self.__build_folder(output, build_folder)
+        if not self.debug_html or tmpdir is None:
+            return
+        utilities.filesystem.mkdirp(tmpdir)
+        with open(Path(tmpdir, output.stem).with_suffix('.html'), 'w') as html_file:
+            html_file.write(html)
+    
+    
+    def __full_fonts (self, script):
+        """
+        Whether to embed whole fonts rather than subsets, per the script's font policy (or its output target's default).
+        """
+        policy = script.options.fonts if script.options.fonts else constants.OUTPUT_TARGETS[script.options.target]['fonts']
+        if policy not in constants.FONT_POLICIES:
+            raise utilities.ScriptmakerValueError(f"expected one of [{', '.join(constants.FONT_POLICIES)}], but received {policy}")
+        return policy == 'full'
+    
+    
+    def __sized_images (self, script, template):
+        """ 
+        Returns the icons (by id) the script references, its logo and the page background, scaled to the size the template draws them at for the script's output target.
+        Nothing else in the datastore is staged, so a render only touches as many files as the script has characters.
+        """
+        if script.options.target not in constants.OUTPUT_TARGETS:
+            raise utilities.ScriptmakerValueError(f"expected one of [{', '.join(constants.OUTPUT_TARGETS)}], but received {script.options.target}")
+        
+        dpi = constants.OUTPUT_TARGETS[script.options.target]['dpi']
+        icons = { id: script.data.get_icon(id) for id in script.asset_ids() if script.data.has_character(id) }
+        logo = script.meta.icon
+        background = backgrounds.variant(templates.get_data, "parchment.jpg", *backgrounds.LETTER, script.options.target)
+        if not dpi:
+            return icons, logo, background
+        
+        # CSS lays out at 96 px to the inch.
+        icon_px = math.ceil(ICON_SIZES[template]['icon'] * dpi / 96)
+        logo_px = math.ceil(ICON_SIZES[template]['logo'] * dpi / 96)
+        icons = { id: icon.resized(icon_px, icon_px) for id, icon in icons.items() }
+        logo = logo.resized(height = logo_px) if logo else None
+        return icons, logo, background
+
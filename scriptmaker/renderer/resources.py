@@ -0,0 +1,69 @@
+from __future__ import annotations
+
+import threading
+import weasyprint
+
+from weasyprint.text.fonts import FontConfiguration
+
+import scriptmaker.utilities as utilities
+
+from . import fetcher
+
+
+# How many decoded images are kept between renders before starting over.
+IMAGE_CACHE_ENTRIES = 4096
+
+
+class RenderResources ():
+    """
+    The weasyprint state worth keeping between renders: parsed packaged stylesheets, the fonts they load, and decoded images.
+    """
+
+    def __init__ (self):
+        """
+        Creates an empty set of resources; everything is loaded on first use.
+        """
+        self.__lock = threading.Lock()
+        self.__font_config = None
+        self.__stylesheets : dict[str, weasyprint.CSS] = {}
+        self.__images = {} # weasyprint's image cache; keyed by URL, so URLs must change (or be evicted) whenever their content does
+
+
+    def evict (self, url):
+        """
+        Forgets the decoded image behind a URL, e.g. because the file it points at was rewritten.
+        """
+        self.__images.pop(url, None)
+
+
+    def stylesheet (self, file):
+        """
+        Parses a packaged stylesheet once, registering its fonts with the shared font configuration.
+        """
+        with self.__lock:
+            if self.__font_config is None:
+                self.__font_config = FontConfiguration()
+            if file not in self.__stylesheets:
+                self.__stylesheets[file] = weasyprint.CSS(url = fetcher.virtual_url(file), url_fetcher = fetcher.VirtualFetcher(), font_config = self.__font_config)
+            return self.__stylesheets[file]
+
+
+    def write_pdf (self, html, styles, url_fetcher, output_file = None, *, full_fonts = True):
+        """
+        Converts HTML to a full-quality PDF with the given packaged stylesheets, reusing everything loaded so far.
+        Writes to output_file (a path or a binary stream) and returns it, or returns the PDF's content if there is none.
+        Without full_fonts, only the glyphs the PDF uses are embedded.
+        """
+        stylesheets = [ self.stylesheet(style) for style in styles ]
+        if len(self.__images) > IMAGE_CACHE_ENTRIES:
+            self.__images.clear()
+
+        # Laid out and written separately (as HTML.write_pdf does), so each can be timed.
+        options = { 'stylesheets': stylesheets, 'cache': self.__images, 'full_fonts': full_fonts }
+        with utilities.profiling.span('weasyprint.layout'):
+            document = weasyprint.HTML(string = html, base_url = fetcher.VIRTUAL_ROOT, url_fetcher = url_fetcher).render(font_config = self.__font_config, **options)
+        with utilities.profiling.span('weasyprint.write_pdf'):
+            content = document.write_pdf(target = output_file, **options)
+        utilities.profiling.count('pages', len(document.pages))
+        utilities.profiling.count('pdfs_rendered')
+        return content if output_file is None else output_file
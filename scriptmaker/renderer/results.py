@@ -0,0 +1,162 @@
+from __future__ import annotations
+
+import hashlib
+import os
+import threading
+
+from collections import OrderedDict
+from pathlib import Path
+
+import scriptmaker.utilities as utilities
+
+
+class MemoryStorage ():
+    """
+    Keeps rendered PDFs in memory, evicting the least recently used once they outgrow max_bytes.
+    """
+
+    def __init__ (self, *, max_bytes = 64 * 1024 * 1024):
+        """
+        Creates an empty store.
+        """
+        self.max_bytes = max_bytes
+        self.__entries : OrderedDict[str, bytes] = OrderedDict()
+        self.__size = 0
+        self.__lock = threading.Lock()
+
+
+    def get (self, key):
+        """
+        Returns the PDF stored under a key, if any.
+        """
+        with self.__lock:
+            if key not in self.__entries:
+                return None
+            self.__entries.move_to_end(key)
+            return self.__entries[key]
+
+
+    def put (self, key, content):
+        """
+        Stores a PDF under a key.
+        """
+        with self.__lock:
+            if key in self.__entries:
+                self.__size -= len(self.__entries.pop(key))
+            self.__entries[key] = content
+            self.__size += len(content)
+            while self.__size > self.max_bytes and len(self.__entries) > 1:
+                _, evicted = self.__entries.popitem(last = False)
+                self.__size -= len(evicted)
+
+
+class DirectoryStorage ():
+    """
+    Keeps rendered PDFs in a directory, evicting the least recently used (by mtime) once they outgrow max_bytes.
+    """
+
+    def __init__ (self, directory = None, *, max_bytes = 512 * 1024 * 1024):
+        """
+        Opens (or creates) a store; if no directory is given, uses the user's scriptmaker cache.
+        """
+        self.directory = Path(directory) if directory else Path(utilities.filesystem.cache_home(), 'renders')
+        self.max_bytes = max_bytes
+        self.__lock = threading.Lock()
+        utilities.filesystem.mkdirp(self.directory)
+
+
+    def get (self, key):
+        """
+        Returns the PDF stored under a key, if any, marking it as recently used.
+        """
+        path = Path(self.directory, f"{key}.pdf")
+        try:
+            with open(path, 'rb') as pdf_file:
+                content = pdf_file.read()
+            os.utime(path)
+            return content
+        except OSError:
+            return None
+
+
+    def put (self, key, content):
+        """
+        Stores a PDF under a key, then enforces the size cap.
+        """
+        utilities.filesystem.write_atomic(Path(self.directory, f"{key}.pdf"), content)
+        with self.__lock:
+            self.__evict()
+
+
+    def __evict (self):
+        """
+        Drops least recently used renders until the rest fit in the size cap.
+        """
+        entries = []
+        for path in self.directory.glob('*.pdf'):
+            try:
+                stat = path.stat()
+                entries.append((stat.st_mtime, stat.st_size, path))
+            except OSError:
+                continue
+        entries.sort()
+
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in entries[:-1]:
+            if total <= self.max_bytes:
+                break
+            path.unlink(missing_ok = True)
+            total -= size
+
+
+class RenderCache ():
+    """
+    Remembers rendered PDFs by a canonical fingerprint of the script (and kind of render) they came from, so repeat renders skip jinja and weasyprint.
+    Storage is pluggable: anything with get(key) and put(key, content), such as MemoryStorage or DirectoryStorage.
+    """
+
+    def __init__ (self, storage = None):
+        """
+        Creates a cache over the given storage, or in memory.
+        """
+        self.storage = storage if storage else MemoryStorage()
+        self.stats = { 'hits': 0, 'misses': 0 }
+        self.__lock = threading.Lock()
+
+
+    def key (self, kind, script):
+        """
+        The cache key for a kind of render ('script', 'nightorder') of a finalized script.
+        """
+        return hashlib.sha256(f"{kind}:{script.fingerprint()}".encode()).hexdigest()
+
+
+    def get (self, key):
+        """
+        Returns the cached PDF bytes for a key, if any.
+        """
+        content = self.storage.get(key)
+        stat = 'hits' if content is not None else 'misses'
+        with self.__lock:
+            self.stats[stat] += 1
+        utilities.profiling.count(f"render_cache_{stat}")
+        return content
+
+
+    def put (self, key, content):
+        """
+        Caches a freshly rendered PDF's content.
+        """
+        self.storage.put(key, content)
+
+
+    def restore (self, key, output_file):
+        """
+        Writes the cached PDF for a key to the output file (unless it is already there), returning whether there was one.
+        """
+        content = self.get(key)
+        if content is None:
+            return False
+        if utilities.manifest.file_digest(output_file) != hashlib.sha256(content).hexdigest():
+            utilities.filesystem.write_atomic(output_file, content)
+        return True
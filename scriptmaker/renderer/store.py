@@ -0,0 +1,160 @@
+from __future__ import annotations
+
+import hashlib
+import os
+import shutil
+import tempfile
+import threading
+
+from pathlib import Path
+
+import scriptmaker.utilities as utilities
+
+
+class BuildStore ():
+    """
+    Keeps a single content-addressed copy of every file a render stages (fonts, backgrounds, stylesheets, icons), and links those copies into build folders.
+    Files already in place with the right content are left alone, so re-rendering costs next to no disk I/O for static assets.
+    Stored copies that no build folder links to any more are pruned, least recently used first, once they outgrow max_bytes.
+    """
+
+    def __init__ (self, directory = None, *, max_bytes = 512 * 1024 * 1024):
+        """
+        Creates a store in the given directory; without one, the store lives in a temporary directory for the life of the process.
+        """
+        self.__tmpdir = None if directory else tempfile.TemporaryDirectory()
+        self.directory = Path(directory if directory else self.__tmpdir.name).resolve()
+        self.max_bytes = max_bytes
+        self.stats = { 'linked': 0, 'skipped': 0, 'stored': 0, 'evictions': 0 }
+
+        self.__lock = threading.Lock()
+        self.__packaged : dict[tuple, tuple[str, Path]] = {} # (getter, file) -> (digest, stored path)
+        self.__unlinked_bytes = None # Counted on the first store, then kept up to date (by this process)
+
+        utilities.filesystem.mkdirp(Path(self.directory, 'objects'))
+
+
+    def put (self, content, digest = None):
+        """
+        Stores some bytes (whose sha256 can be supplied if already known), returning the digest and the stored path.
+        """
+        digest = digest if digest else hashlib.sha256(content).hexdigest()
+        path = Path(self.directory, 'objects', digest)
+        try:
+            os.utime(path)
+        except OSError:
+            utilities.filesystem.write_atomic(path, content)
+            with self.__lock:
+                self.stats['stored'] += 1
+                if self.__unlinked_bytes is None or self.__unlinked_bytes + len(content) > self.max_bytes:
+                    self.__evict(keep = path)
+                else:
+                    self.__unlinked_bytes += len(content)
+        return digest, path
+
+
+    def stage (self, content, destination, digest = None):
+        """
+        Places some bytes at a destination by linking it to the stored copy, unless the destination already holds them.
+        Returns whether the destination had to be (re)placed.
+        """
+        digest, source = self.put(content, digest)
+        try:
+            return self.__link(source, Path(destination), digest)
+        except FileNotFoundError:
+            # Another process pruned the stored copy before it could be linked.
+            digest, source = self.put(content, digest)
+            return self.__link(source, Path(destination), digest)
+
+
+    def stage_packaged (self, get_data, file, dirname):
+        """
+        Places a packaged file (read with the given get_data, e.g. templates.get_data) into a directory; each packaged file is only read and hashed once.
+        Returns whether the file had to be (re)placed.
+        """
+        key = (get_data.__module__, file)
+        with self.__lock:
+            entry = self.__packaged.get(key)
+        if entry is None or not entry[1].exists():
+            entry = self.put(get_data(file))
+            with self.__lock:
+                self.__packaged[key] = entry
+
+        digest, source = entry
+        try:
+            return self.__link(source, Path(dirname, file), digest)
+        except FileNotFoundError:
+            with self.__lock:
+                self.__packaged.pop(key, None)
+            return self.stage_packaged(get_data, file, dirname)
+
+
+    def __evict (self, keep):
+        """
+        Drops least recently used (by mtime) stored copies that nothing links to, until the rest fit in the size cap.
+        Copies that build folders hardlink to cost no extra space, so they are left alone.
+        """
+        entries = []
+        for path in Path(self.directory, 'objects').iterdir():
+            if path.name.startswith('.') or path == keep:
+                continue
+            try:
+                stat = path.stat()
+                if stat.st_nlink == 1:
+                    entries.append((stat.st_mtime, stat.st_size, path))
+            except OSError:
+                continue
+        entries.sort()
+
+        total = sum(size for _, size, _ in entries) + keep.stat().st_size
+        for _, size, path in entries:
+            if total <= self.max_bytes:
+                break
+            path.unlink(missing_ok = True)
+            self.stats['evictions'] += 1
+            total -= size
+        self.__unlinked_bytes = total
+
+
+    def __link (self, source, destination, digest):
+        """
+        Hardlinks a stored file to a destination, falling back to a copy (e.g. across filesystems).
+        Never symlinks: stored copies can be pruned, and temporary stores vanish with their process, which would leave dangling links behind.
+        """
+        if self.__holds(destination, source, digest):
+            with self.__lock:
+                self.stats['skipped'] += 1
+            return False
+
+        utilities.filesystem.mkdirp(destination.parent)
+        tmp_path = destination.with_name(f".{destination.name}.{os.getpid()}-{threading.get_ident()}.tmp")
+        for place in [os.link, shutil.copyfile]:
+            try:
+                place(source, tmp_path)
+                break
+            except OSError:
+                continue
+        os.replace(tmp_path, destination)
+
+        with self.__lock:
+            self.stats['linked'] += 1
+        return True
+
+
+    def __holds (self, destination, source, digest):
+        """
+        Checks whether a destination already has the stored content: cheaply if it is a link, by size and hash otherwise.
+        """
+        try:
+            if os.path.samefile(destination, source):
+                return True
+            if os.path.getsize(destination) != os.path.getsize(source):
+                return False
+            with open(destination, 'rb') as existing:
+                return hashlib.sha256(existing.read()).hexdigest() == digest
+        except OSError:
+            return False
+
+
+# The store renderers stage through unless told otherwise; temporary until someone gives it a directory.
+shared = BuildStore()
@@ -0,0 +1,79 @@
+from __future__ import annotations
+
+import hashlib
+
+from jinja2 import BytecodeCache, Environment, PackageLoader
+from pathlib import Path
+
+import scriptmaker.templates as templates
+import scriptmaker.utilities as utilities
+
+
+# Bytecode compiled at build time (see bin/assemble); it is only used when its Python version and template source still match.
+SHIPPED_BYTECODE = Path(Path(templates.__file__).parent, "compiled")
+
+
+class TemplateBytecodeCache (BytecodeCache):
+    """
+    Keeps compiled template bytecode in a writable directory, falling back to the bytecode shipped with the package.
+    Entries are keyed by template name alone (jinja checks the source checksum on load), so shipped bytecode is valid wherever the package is installed.
+    """
+
+    def __init__ (self, directory = None):
+        """
+        Creates a bytecode cache; without a directory, only the shipped bytecode is used and nothing is written.
+        """
+        self.directory = Path(directory) if directory else None
+        if self.directory:
+            utilities.filesystem.mkdirp(self.directory)
+
+
+    def get_cache_key (self, name, filename = None):
+        return hashlib.sha1(name.encode("utf-8")).hexdigest()
+
+
+    def load_bytecode (self, bucket):
+        for directory in [self.directory, SHIPPED_BYTECODE]:
+            if not directory:
+                continue
+            try:
+                with open(Path(directory, f"{bucket.key}.cache"), "rb") as bytecode_file:
+                    bucket.load_bytecode(bytecode_file)
+            except OSError:
+                continue
+            if bucket.code is not None:
+                return
+
+
+    def dump_bytecode (self, bucket):
+        if self.directory:
+            utilities.filesystem.write_atomic(Path(self.directory, f"{bucket.key}.cache"), bucket.bytecode_to_string())
+
+
+def create_environment (bytecode_directory = None):
+    """
+    Creates a jinja environment that loads templates straight from the package, compiling each at most once per process.
+    Compiled bytecode is persisted to the given directory, if any.
+    """
+    return Environment(
+        loader = PackageLoader("scriptmaker", "templates"),
+        extensions = ['jinja2.ext.loopcontrols'],
+        bytecode_cache = TemplateBytecodeCache(bytecode_directory),
+        auto_reload = False # Packaged templates never change under a running process
+    )
+
+
+def precompile (directory = None):
+    """
+    Compiles every packaged template into the given directory (by default, the package's shipped bytecode).
+    """
+    directory = Path(directory) if directory else SHIPPED_BYTECODE
+    environment = create_environment(directory)
+    names = environment.list_templates(extensions = ["jinja"])
+    for name in names:
+        environment.get_template(name)
+    return names
+
+
+# The environment renderers use unless told otherwise.
+shared = create_environment()
@@ -1,39 +1,90 @@
 from __future__ import annotations
 
 import drawsvg
-import re
-import weasyprint
+import hashlib
+import io
 
-from jinja2 import Environment, FileSystemLoader
 from pathlib import Path
 
+import scriptmaker.constants as constants
 import scriptmaker.data as data
 import scriptmaker.models as models
 import scriptmaker.templates as templates 
 import scriptmaker.utilities as utilities
 
+from . import backgrounds, fetcher, resources, store, templating
+
 PAGE_COUNTS = {
     38: 20,
     19: 80
 }
 
+# Token text is curved along this arc (x1, x2, y, radius: from x1,y to x2,y) of a 500x500 drawing, in this font, and rasterized at this scale.
+TEXT_ARC = (75, 425, 250, 175)
+TEXT_FONT = 'Dumbledor 1'
+TEXT_SCALE = 2
+
+
+def text_image (text, *, size, fill, stroke = None, stroke_width = None):
+    """
+    Returns a PNG of text curved along the bottom of a token.
+    Images are remembered in the shared DerivativeCache by everything that changes how they look, so the same text is only ever rasterized once.
+    """
+    key = ('token-text', text, TEXT_FONT, size, fill, stroke, stroke_width, TEXT_ARC, TEXT_SCALE)
+
+    def __rasterize ():
+        x1, x2, y, radius = TEXT_ARC
+        d = drawsvg.Drawing(500, 500)
+        p = drawsvg.Path(fill = 'transparent')
+        p.M(x1, y)
+        p.A(radius, radius, 0, 0, 0, x2, y)
+        d.append(p)
+        outline = { 'stroke': stroke, 'stroke_width': stroke_width } if stroke else {}
+        d.append(drawsvg.Text(text, size, path = p, fill = fill, text_anchor = 'middle', center = True, font_family = TEXT_FONT, **outline))
+        d.set_pixel_scale(TEXT_SCALE)
+        with utilities.profiling.span('tokenize.text'):
+            png = d.rasterize().png_data
+        utilities.profiling.count('token_texts_rasterized')
+        return png
+
+    return data.derivatives.shared.get(key, __rasterize)
+
+
 class Tokenizer ():
     """ 
     Lays out tokens in a datastore for physical printing.
     """
     
+    def __init__ (self, *, debug_html = False, fonts = 'full', target = 'print'):
+        """ 
+        Creates a tokenizer. A tokenizer keeps its parsed stylesheets, fonts and decoded images between renders, so reuse one instance for many sheets.
+        With debug_html, the HTML handed to weasyprint is also saved into the build folder, for introspection.
+        Token sheets are for printing, so fonts are embedded whole unless fonts is 'subset' (see constants.FONT_POLICIES), and token art is sized for the print target unless told otherwise.
+        """
+        if fonts not in constants.FONT_POLICIES:
+            raise utilities.ScriptmakerValueError(f"expected one of [{', '.join(constants.FONT_POLICIES)}], but received {fonts}")
+        if target not in constants.OUTPUT_TARGETS:
+            raise utilities.ScriptmakerValueError(f"expected one of [{', '.join(constants.OUTPUT_TARGETS)}], but received {target}")
+        self.resources = resources.RenderResources()
+        self.debug_html = debug_html
+        self.fonts = fonts
+        self.target = target
+    
+    
     def render (
         self, datastore : data.Datastore, *,
         name, 
         characters = list[models.Character],
         character_copies = {},
         output_folder = None,
+        streams = None,
         render_everything = False,
         character_token_size, 
         reminder_token_size
     ):
         """
-        Renders a script's (or it's datastore's) entire token set into a physically-printable layout.
+        Renders a script's (or it's datastore's) entire token set into a physically-printable layout, returning the paths to the character and reminder sheets.
+        Given writable binary streams for each sheet instead ({ 'character': ..., 'reminder': ... }), writes the PDFs to them without touching any folders, and returns the streams.
         """
         if character_token_size not in [38]:
             raise Exception(f"cannot handle characters of size {character_token_size}: wait for Avery support!")
@@ -41,57 +92,70 @@ class Tokenizer ():
         if reminder_token_size not in [19]:
             raise Exception(f"cannot handle reminders of size {reminder_token_size}: wait for Avery support!")
 
-        # What are we rendering, and to where?
-        folder = Path(output_folder, 'pdf') if output_folder else Path(datastore.workspace, "pdf")
-        utilities.filesystem.mkdirp(folder)
-                
-        tmpdir = Path(folder.parent, 'build')
-        utilities.filesystem.mkdirp(tmpdir)
+        # The token backdrop and leaves are drawn over whole character tokens, so are only needed at that size.
+        token_inches = character_token_size / 25.4
+        token_art = { file: backgrounds.variant(templates.tokens.get_data, file, token_inches, token_inches, self.target) for file in templates.tokens.COMMON }
+        
+        # What are we rendering, and to where? Renders to streams have no folders, so weasyprint reads every asset from memory.
+        assets = fetcher.VirtualFetcher()
+        if streams is None:
+            folder = Path(output_folder, 'pdf') if output_folder else Path(datastore.workspace, "pdf")
+            utilities.filesystem.mkdirp(folder)
+                    
+            tmpdir = Path(folder.parent, 'build')
+            utilities.filesystem.mkdirp(tmpdir)
+            
+            text_folder = Path(tmpdir, 'text').resolve()
+            leaves = { file: f"file://{Path(tmpdir, art.name).resolve()}" for file, art in token_art.items() }
+        else:
+            tmpdir = None
+            leaves = { file: assets.add(f"tokens/{art.name}", art.content, art.mime) for file, art in token_art.items() }
+        
+        # Text images are named by their content, so each distinct text is placed once per run however many tokens share it, and a name never changes what it shows.
+        text_urls = {}
+        def text_url (text, **style):
+            key = (text, *sorted(style.items()))
+            if key not in text_urls:
+                png = text_image(text, **style)
+                digest = hashlib.sha256(png).hexdigest()
+                if tmpdir:
+                    path = Path(text_folder, f"{digest}.png")
+                    text_urls[key] = f"file://{path}"
+                    if store.shared.stage(png, path, digest):
+                        self.resources.evict(text_urls[key])
+                else:
+                    text_urls[key] = assets.add(f"text/{digest}.png", png, 'image/png')
+                utilities.profiling.count('token_texts')
+            return text_urls[key]
         
         # Build a parameter set for each character we want to print.
+        if render_everything:
+            datastore.materialize()
         character_set = datastore.characters.values() if render_everything else [datastore.characters[char.id] for char in characters]
         
         character_tokens = []
         reminder_tokens = []
         
-        # Create the stupid name SVGs in here because Weasyprint sucks...
+        # Weasyprint can't curve text, so names and reminders are drawn as images.
         class CharacterToken ():
-            def __init__ (self, *, id, name, ability, icon, setup, first, other, reminders, out):
+            def __init__ (self, *, id, name, ability, icon, setup, first, other, reminders):
                 self.id = id; self.name = name.upper(); self.ability = ability; self.icon = icon
                 self.setup = setup; self.first = first; self.other = other; self.reminders = reminders
-                self.ability = re.sub(r'(?P<setup>\[.*\])', '<b>\g<setup></b>', self.ability)
                 self.fontsize = "-large" if len(self.ability) >= 125 else ""
-                d = drawsvg.Drawing(500, 500)
-                p = drawsvg.Path(fill='transparent')
-                p.M(75, 250)
-                p.A(175, 175, 0, 0, 0, 425, 250)
-                d.append(p)
-                t = drawsvg.Text(self.name, 60, path=p, stroke='white', stroke_width='1', fill='black', text_anchor = 'middle', center = True, font_family = 'Dumbledor 1')
-                d.append(t)
-                self.name = Path(out, f"{self.id}.png").resolve()
-                d.set_pixel_scale(2)
-                d.save_png(str(self.name)) 
-                self.name = f"file://{self.name}"      
+                self.name = text_url(self.name, size = 60, fill = 'black', stroke = 'white', stroke_width = '1')
 
 
         class ReminderToken ():
-            def __init__ (self, *, id, icon, text, out):
+            def __init__ (self, *, id, icon, text):
                 self.id = id; self.icon = icon; self.text = text
-                d = drawsvg.Drawing(500, 500)
-                p = drawsvg.Path(fill='transparent')
-                p.M(75, 250)
-                p.A(175, 175, 0, 0, 0, 425, 250)
-                d.append(p)
-                t = drawsvg.Text(self.text, 70, path = p, fill='white', text_anchor = 'middle', center = True, font_family = 'Dumbledor 1')
-                d.append(t)
-                self.text = Path(out, f"{self.id}.png").resolve()
-                d.set_pixel_scale(2)
-                d.save_png(str(self.text))
-                self.text = f"file://{self.text}"
+                self.text = text_url(self.text, size = 70, fill = 'white')
         
         
-        text_svg_folder = Path(tmpdir, 'svgs').resolve()
-        utilities.filesystem.mkdirp(text_svg_folder)
+        cropped_icons = { character.id: datastore.icons[character.id].crop() for character in character_set }
+        if tmpdir:
+            icon_urls = { id: f"file://{cropped.path(Path(tmpdir, 'icons').resolve())}" for id, cropped in cropped_icons.items() }
+        else:
+            icon_urls = { id: assets.add(f"images/{cropped.path(cropped.hash).name}", cropped.data, cropped.mime) for id, cropped in cropped_icons.items() }
 
         for character in character_set:
             if character.team == '_meta': continue
@@ -99,13 +163,12 @@ class Tokenizer ():
             reminder_count = len(character.reminders + character.remindersGlobal)
             character_entry = CharacterToken(
                 id = character.id,
-                name = character.name, ability = character.ability,
-                icon = f"file://{datastore.icons[character.id].path(Path(tmpdir, 'icons').resolve())}",
-                setup = f"file://{Path(tmpdir,'leaf-setup.png').resolve()}" if character.setup else None,
-                first = f"file://{Path(tmpdir,'leaf-first.png').resolve()}" if character.nightinfo['first']['acts'] else None,
-                other = f"file://{Path(tmpdir,'leaf-other.png').resolve()}" if character.nightinfo['other']['acts'] else None,
-                reminders = f"file://{Path(tmpdir, f'leaf-reminder-{min(reminder_count, 7)}.png').resolve()}" if reminder_count > 0 else None,
-                out = text_svg_folder
+                name = character.name, ability = character.markup['ability'],
+                icon = icon_urls[character.id],
+                setup = leaves['leaf-setup.png'] if character.setup else None,
+                first = leaves['leaf-first.png'] if character.nightinfo['first']['acts'] else None,
+                other = leaves['leaf-other.png'] if character.nightinfo['other']['acts'] else None,
+                reminders = leaves[f'leaf-reminder-{min(reminder_count, 7)}.png'] if reminder_count > 0 else None
             )
             character_tokens.extend([character_entry] * character_copies.get(character.id, 1))
 
@@ -113,73 +176,82 @@ class Tokenizer ():
                 reminder_entry = ReminderToken(
                     id = f"{character.id}-{i}",
                     icon = character_entry.icon,
-                    text = reminder_text,
-                    out = text_svg_folder
+                    text = reminder_text
                 )
                 reminder_tokens.extend([reminder_entry])
 
-        # Load every asset we need into the build workspace.
-
-        for file in templates.COMMON:
-            file_content = templates.get_data(file)
-            with open(Path(tmpdir, file), "wb") as tmpfile:
-                tmpfile.write(file_content)
-        
-        for file in templates.tokens.COMMON:
-            file_content = templates.tokens.get_data(file)
-            with open(Path(tmpdir, file), 'wb') as tmpfile:
-                tmpfile.write(file_content)
+        # Link every asset we need into the build workspace.
+        if tmpdir:
+            with utilities.profiling.span('render.stage'):
+                for file in templates.COMMON:
+                    store.shared.stage_packaged(templates.get_data, file, tmpdir)
+            
+                for file, art in token_art.items():
+                    if store.shared.stage(art.content, Path(tmpdir, art.name), art.hash):
+                        self.resources.evict(leaves[file])
+            
+                for id, cropped in cropped_icons.items():
+                    if store.shared.stage(cropped.data, cropped.path(Path(tmpdir, 'icons')), cropped.hash):
+                        self.resources.evict(icon_urls[id])
         
-        utilities.filesystem.mkdirp(Path(tmpdir, 'icons'))
-        for character in character_set:
-            cropped = datastore.icons[character.id].crop()
-            cropped.save(Path(tmpdir, 'icons'))
-
         n = PAGE_COUNTS[character_token_size]
         characters_paged = [character_tokens[i:i+n] for i in range(0, len(character_tokens), n)]
 
         n = PAGE_COUNTS[reminder_token_size]
         reminders_paged = [reminder_tokens[i:i+n] for i in range(0, len(reminder_tokens), n)]
 
-        paths = []
+        outputs = []
         for mode in ['character', 'reminder']:
             token_size = character_token_size if mode == 'character' else reminder_token_size
 
             # Set up all other params.
             css_path = f'{mode}-tokens-{token_size}.css'
             jinja_path = f'{mode}-tokens.jinja'
-            out_path = Path(folder, f"{utilities.sanitize.name(name)}-{mode}-tokens.pdf")
-            token_path = f"file://{Path(tmpdir, 'token.png').resolve()}"
 
-            for file in [jinja_path, css_path]:
-                file_content = templates.get_data(file)
-                with open(Path(tmpdir, file), 'wb') as tmpfile:
-                    tmpfile.write(file_content)
+            if tmpdir:
+                store.shared.stage_packaged(templates.get_data, css_path, tmpdir)
 
             params = {
                 "characters": characters_paged,
                 "reminders": reminders_paged,
-                "token_background": token_path,
+                "token_background": leaves['token.png'],
                 "character_size": f"{character_token_size}mm",
                 "reminder_size": f"{reminder_token_size}mm",
             }
             
             # Render everything and save.
-            loader = FileSystemLoader(tmpdir)
-            env = Environment(loader = loader, extensions=['jinja2.ext.loopcontrols'])
-            html = env.get_template(jinja_path).render(params)
-
-            with open(Path(tmpdir, out_path.stem).with_suffix('.html'), 'w') as html_file:
-                html_file.write(html)
-                
-            utilities.filesystem.mkdirp(Path(out_path).parent)
+            with utilities.profiling.span('render.jinja'):
+                html = templating.shared.get_template(jinja_path).render(params)
             
-            weasyprint.HTML(string = html).write_pdf(
-                target = out_path,
-                stylesheets = [Path(tmpdir, css_path), Path(tmpdir, 'common.css')],
-                jpeg_quality = 95,
-                full_fonts = True
-            )
-
-            paths.append(out_path)
-        return paths
+            if streams is not None:
+                outputs.append(self.resources.write_pdf(html, [css_path, 'common.css'], assets, streams[mode], full_fonts = self.fonts == 'full'))
+                continue
+            
+            out_path = Path(folder, f"{utilities.sanitize.name(name)}-{mode}-tokens.pdf")
+            if self.debug_html:
+                with open(Path(tmpdir, out_path.stem).with_suffix('.html'), 'w') as html_file:
+                    html_file.write(html)
+            
+            outputs.append(self.resources.write_pdf(html, [css_path, 'common.css'], assets, out_path, full_fonts = self.fonts == 'full'))
+            utilities.profiling.count('pdf_bytes_written', out_path.stat().st_size)
+        return outputs
+    
+    
+    def render_bytes (self, datastore : data.Datastore, **kwargs):
+        """
+        Renders a token set as render() does, returning the content of each sheet ({ 'character': ..., 'reminder': ... }).
+        """
+        streams = { 'character': io.BytesIO(), 'reminder': io.BytesIO() }
+        self.render(datastore, streams = streams, **kwargs)
+        return { mode: stream.getvalue() for mode, stream in streams.items() }
+    
+    
+    def warm_up (self):
+        """ 
+        Parses every token stylesheet and loads their fonts now, and prepares the token art, rather than during the first render.
+        """
+        for style in ["common.css", "character-tokens-38.css", "reminder-tokens-19.css"]:
+            self.resources.stylesheet(style)
+        for file in templates.tokens.COMMON:
+            backgrounds.variant(templates.tokens.get_data, file, 38 / 25.4, 38 / 25.4, self.target)
+        return self
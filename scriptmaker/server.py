@@ -0,0 +1,290 @@
+from __future__ import annotations
+
+import concurrent.futures
+import json
+import os
+import socket
+import socketserver
+import threading
+import time
+import traceback
+
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
+
+import scriptmaker.constants as constants
+import scriptmaker.renderer as renderer
+import scriptmaker.utilities as utilities
+
+
+# The largest script (plus nightorder) body accepted, in bytes.
+MAX_BODY_BYTES = 4 * 1024 * 1024
+
+# Boolean query options, and the ScriptOptions they switch on.
+FLAGS = {
+    'bucket': 'bucket',
+    'force_jinxes': 'force_jinxes',
+    'i18n_fallback': 'i18n_fallback',
+    'simple': 'simple_nightorder'
+}
+
+
+class RenderServer ():
+    """
+    Keeps a datastore and renderers warm between requests, so that rendering a script costs only the render itself.
+    Renders run on a fixed pool of worker threads; requests beyond those wait in a bounded queue, and are refused once it is full.
+    """
+
+    def __init__ (
+        self, datastore, *,
+        workers = 2, # Renders running at once; each worker thread keeps its own Renderer
+        queue_size = 16, # Requests waiting for a worker before new ones are refused
+        timeout = 60, # Seconds a request may take, waiting included, before it is given up on
+        cache = None # A RenderCache shared by every worker's Renderer
+    ):
+        """
+        Creates a server over a datastore of the characters scripts may use (usually the official ones); requests load their scripts into overlays of it.
+        """
+        self.datastore = datastore.freeze()
+        self.workers = workers
+        self.queue_size = queue_size
+        self.timeout = timeout
+        self.cache = cache
+
+        self.metrics = { 'requests': 0, 'rendered': 0, 'failed': 0, 'rejected': 0, 'timed_out': 0, 'render_seconds': 0.0 }
+        self.__lock = threading.Lock()
+        self.__pending = 0
+        self.__local = threading.local()
+        self.__executor = concurrent.futures.ThreadPoolExecutor(max_workers = workers, thread_name_prefix = 'scriptmaker-render')
+        self.__started = time.monotonic()
+
+
+    def warm_up (self):
+        """
+        Loads everything a render needs up front: the base characters, and each worker's stylesheets and fonts.
+        """
+        self.datastore.materialize()
+
+        # The barrier holds each task until all are running, so every worker thread is started and gets one.
+        barrier = threading.Barrier(self.workers)
+        def __warm_up (_):
+            self.__renderer().warm_up()
+            barrier.wait()
+        list(self.__executor.map(__warm_up, range(self.workers)))
+        return self
+
+
+    def health (self):
+        """
+        A snapshot of the server's state and counters.
+        """
+        with self.__lock:
+            return {
+                'status': 'ok',
+                'version': utilities.package.version(),
+                'uptime_seconds': round(time.monotonic() - self.__started, 3),
+                'workers': self.workers,
+                'queue_size': self.queue_size,
+                'pending': self.__pending,
+                **self.metrics,
+                **({ f"cache_{stat}": count for stat, count in self.cache.stats.items() } if self.cache else {})
+            }
+
+
+    def render (self, body, query):
+        """
+        Renders a request: a body of script JSON (or {"script": ..., "nights": ...}), and query options.
+        The kind option picks the PDF ('script', or 'nightorder' with simple=1 for the simple variant); the other options are as in make-pdf.
+        Returns an HTTP status, a content type and the response body.
+        """
+        with self.__lock:
+            self.metrics['requests'] += 1
+            if self.__pending >= self.workers + self.queue_size:
+                self.metrics['rejected'] += 1
+                return 503, 'application/json', self.__error(f"{self.queue_size} renders are already waiting; try again later")
+            self.__pending += 1
+
+        future = self.__executor.submit(self.__render, body, query)
+        future.add_done_callback(self.__finished)
+        try:
+            return future.result(timeout = self.timeout)
+        except concurrent.futures.TimeoutError:
+            # A running render can't be interrupted, but one still waiting for a worker can be dropped.
+            future.cancel()
+            with self.__lock:
+                self.metrics['timed_out'] += 1
+            return 504, 'application/json', self.__error(f"render took longer than {self.timeout}s")
+
+
+    def serve (self, host = '127.0.0.1', port = 8600, unix_socket = None):
+        """
+        Serves requests over HTTP until interrupted, on a TCP port or (if given) a Unix socket path.
+        """
+        if unix_socket:
+            if os.path.exists(unix_socket):
+                os.unlink(unix_socket)
+            httpd = UnixHTTPServer(unix_socket, RequestHandler)
+        else:
+            httpd = ThreadingHTTPServer((host, port), RequestHandler)
+        httpd.daemon_threads = True
+        httpd.render_server = self
+
+        try:
+            httpd.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            httpd.server_close()
+            self.__executor.shutdown(wait = False, cancel_futures = True)
+            if unix_socket and os.path.exists(unix_socket):
+                os.unlink(unix_socket)
+
+
+    def __finished (self, future):
+        """
+        Frees the request's place in the queue once its worker is done with it (or it was dropped before starting).
+        """
+        with self.__lock:
+            self.__pending -= 1
+
+
+    def __render (self, body, query):
+        """
+        Loads and renders a request on a worker thread.
+        """
+        try:
+            kind = query.get('kind', 'script')
+            if kind not in ['script', 'nightorder']:
+                return 400, 'application/json', self.__error(f"unknown kind '{kind}'; expected 'script' or 'nightorder'")
+
+            target = query.get('target', 'screen')
+            if target not in constants.OUTPUT_TARGETS:
+                return 400, 'application/json', self.__error(f"unknown target '{target}'; expected one of {', '.join(constants.OUTPUT_TARGETS)}")
+
+            try:
+                request = json.loads(body)
+            except ValueError as e:
+                return 400, 'application/json', self.__error(f"body is not JSON: {e}")
+            script_json, nights_json = (request.get('script'), request.get('nights')) if isinstance(request, dict) else (request, None)
+
+            started = time.perf_counter()
+            script = self.datastore.overlay().load_script(script_json, nights_json = nights_json)
+            for flag, option in FLAGS.items():
+                setattr(script.options, option, query.get(flag, '0').lower() in ['1', 'true', 'yes'])
+            script.options.target = target
+            script.options.fonts = query.get('fonts')
+
+            # Rendered straight to bytes; nothing is written to disk.
+            render = self.__renderer().render_script_bytes if kind == 'script' else self.__renderer().render_nightorder_bytes
+            content = render(script)
+
+            with self.__lock:
+                self.metrics['rendered'] += 1
+                self.metrics['render_seconds'] += time.perf_counter() - started
+            return 200, 'application/pdf', content
+
+        except (utilities.ScriptmakerError, TypeError, ValueError, KeyError) as e:
+            with self.__lock:
+                self.metrics['failed'] += 1
+            return 422, 'application/json', self.__error(str(e) or type(e).__name__)
+
+        except Exception:
+            with self.__lock:
+                self.metrics['failed'] += 1
+            return 500, 'application/json', self.__error(traceback.format_exc())
+
+
+    def __renderer (self):
+        """
+        The calling worker's Renderer; renders to bytes always run in memory, so there is no build folder to keep between requests.
+        Requests aren't trusted, so their renders can't reach the network or the server's files.
+        """
+        if not hasattr(self.__local, 'renderer'):
+            self.__local.renderer = renderer.Renderer(cache = self.cache, trusted = False)
+        return self.__local.renderer
+
+
+    @staticmethod
+    def __error (message):
+        """
+        Encodes an error response body.
+        """
+        return json.dumps({ 'error': message }).encode()
+
+
+class RequestHandler (BaseHTTPRequestHandler):
+    """
+    Routes HTTP requests to the server's RenderServer:
+
+        GET  /health  - status and counters, as JSON
+        GET  /metrics - the same counters, in the Prometheus text format
+        POST /render  - renders the script JSON in the body, returning the PDF
+    """
+
+    protocol_version = 'HTTP/1.1'
+
+    def do_GET (self):
+        path = urlsplit(self.path).path
+        if path == '/health':
+            self.__respond(200, 'application/json', json.dumps(self.server.render_server.health()).encode())
+        elif path == '/metrics':
+            lines = []
+            for name, value in self.server.render_server.health().items():
+                if isinstance(value, (int, float)) and not isinstance(value, bool):
+                    lines.append(f"scriptmaker_serve_{name} {value}")
+            self.__respond(200, 'text/plain; version=0.0.4', ("\n".join(lines) + "\n").encode())
+        else:
+            self.__respond(404, 'application/json', json.dumps({ 'error': f"no such endpoint '{path}'" }).encode())
+
+
+    def do_POST (self):
+        url = urlsplit(self.path)
+        if url.path != '/render':
+            self.__respond(404, 'application/json', json.dumps({ 'error': f"no such endpoint '{url.path}'" }).encode())
+            return
+
+        # Without a length, there is no telling where the body ends.
+        length = self.headers.get('Content-Length')
+        if length is None:
+            self.close_connection = True
+            self.__respond(411, 'application/json', json.dumps({ 'error': "Content-Length is required" }).encode())
+            return
+        if not length.strip().isdigit():
+            self.close_connection = True
+            self.__respond(400, 'application/json', json.dumps({ 'error': f"invalid Content-Length '{length}'" }).encode())
+            return
+
+        length = int(length)
+        if length > MAX_BODY_BYTES:
+            self.close_connection = True
+            self.__respond(413, 'application/json', json.dumps({ 'error': f"body is larger than {MAX_BODY_BYTES} bytes" }).encode())
+            return
+
+        query = { key: values[-1] for key, values in parse_qs(url.query).items() }
+        self.__respond(*self.server.render_server.render(self.rfile.read(length), query))
+
+
+    def address_string (self):
+        # Unix socket clients have no address.
+        return self.client_address[0] if self.client_address else 'local'
+
+
+    def __respond (self, status, content_type, content):
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(content)))
+        self.end_headers()
+        self.wfile.write(content)
+
+
+class UnixHTTPServer (ThreadingHTTPServer):
+    """
+    A ThreadingHTTPServer listening on a Unix socket path instead of a TCP port.
+    """
+
+    address_family = socket.AF_UNIX
+
+    def server_bind (self):
+        socketserver.TCPServer.server_bind(self)
+        self.server_name = 'localhost'
+        self.server_port = 0
@@ -7,8 +7,6 @@ from . import tokens
 COMMON = [
     "19mm-blank.png",
     "38mm-blank.png",
-    "paper.jpg",
-    "parchment.jpg",
     "CormorantGaramond-Bold.ttf",
     "CormorantGaramond-Medium.ttf",
     "Dumbledor 1.ttf",
@@ -1,9 +1,14 @@
 
 from . import filesystem
+from . import manifest
+from . import markup
+from . import package
 from . import pdftools
+from . import profiling
 from . import sanitize
 
 from .error import *
 from .filesystem import ScriptmakerFSError
 from .kwarg import KWArgPreparer
-from .pdftools import PDFTools
\ No newline at end of file
+from .pdftools import PDFTools
+from .profiling import Profiler
\ No newline at end of file
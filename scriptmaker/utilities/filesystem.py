@@ -1,5 +1,6 @@
 
 import os
+import threading
 
 from pathlib import Path 
 
@@ -21,4 +22,24 @@ def mkdirp (directory):
         raise ScriptmakerFSError(f'cannot create directory at {directory}: file exists')
     
     if not os.path.exists(directory):
-        os.mkdir(directory)
\ No newline at end of file
+        os.makedirs(directory, exist_ok = True)
+
+
+def cache_home ():
+    """ 
+    Locates scriptmaker's persistent cache directory; $SCRIPTMAKER_CACHE_DIR wins, then $XDG_CACHE_HOME, then ~/.cache.
+    """
+    if os.environ.get('SCRIPTMAKER_CACHE_DIR'):
+        return Path(os.environ['SCRIPTMAKER_CACHE_DIR'])
+    xdg_cache = os.environ.get('XDG_CACHE_HOME')
+    return Path(xdg_cache if xdg_cache else Path.home() / '.cache', 'scriptmaker')
+
+
+def write_atomic (path, content):
+    """ 
+    Writes bytes to a path via a sibling temporary file, so readers never observe a partial file.
+    """
+    tmp_path = Path(path).with_name(f".{Path(path).name}.{os.getpid()}-{threading.get_ident()}.tmp")
+    with open(tmp_path, 'wb') as tmp_file:
+        tmp_file.write(content)
+    os.replace(tmp_path, path)
@@ -0,0 +1,72 @@
+
+import hashlib
+import json
+
+from pathlib import Path
+
+from . import filesystem
+
+
+MANIFEST_FILE = ".scriptmaker-manifest.json"
+
+
+def file_digest (path):
+    """
+    Hashes a file's content, or returns None if it cannot be read.
+    """
+    try:
+        with open(path, 'rb') as file:
+            return hashlib.sha256(file.read()).hexdigest()
+    except OSError:
+        return None
+
+
+def is_current (entry, fingerprint):
+    """
+    Checks whether a manifest entry was built from the given fingerprint, and its outputs are all still as they were built.
+    """
+    if not entry or entry.get('fingerprint') != fingerprint:
+        return False
+    return all(file_digest(path) == digest for path, digest in entry.get('outputs', {}).items())
+
+
+def make_entry (fingerprint, outputs):
+    """
+    Records a fingerprint and the digests of the outputs built from it.
+    """
+    return {
+        "fingerprint": fingerprint,
+        "outputs": { str(path): file_digest(path) for path in outputs }
+    }
+
+
+class BuildManifest ():
+    """
+    Remembers, per input, the fingerprint of everything it was last built from, and the outputs that build produced.
+    """
+
+    def __init__ (self, directory):
+        """
+        Loads the manifest in the given directory, if there is one.
+        """
+        self.path = Path(directory, MANIFEST_FILE)
+        try:
+            with open(self.path) as manifest_file:
+                self.entries = json.load(manifest_file)
+        except (OSError, ValueError):
+            self.entries = {}
+
+
+    def prune (self, keys):
+        """
+        Forgets every input but the given ones, e.g. scripts that have since been deleted or renamed.
+        """
+        keys = set(keys)
+        self.entries = { key: entry for key, entry in self.entries.items() if key in keys }
+
+
+    def save (self):
+        """
+        Writes the manifest back to its directory.
+        """
+        filesystem.write_atomic(self.path, json.dumps(self.entries, indent = 2, sort_keys = True).encode())
@@ -0,0 +1,24 @@
+import functools
+import re
+
+
+SETUP_HINT = re.compile(r'(?P<setup>\[.*\])')
+EMPHASIS = re.compile(r'\*(?P<bold>[A-Za-z\s-]+)\*')
+REMINDER_MARKER = re.compile(r' :reminder:')
+
+
+@functools.lru_cache(maxsize = 4096)
+def ability (text):
+    """ 
+    Bolds the setup hint in an ability, e.g. "[+2 Outsiders]".
+    """
+    return SETUP_HINT.sub(r'<b>\g<setup></b>', text)
+
+
+@functools.lru_cache(maxsize = 4096)
+def reminder (text):
+    """ 
+    Bolds *emphasized* words in a nightorder reminder and drops the app's :reminder: markers.
+    """
+    text = EMPHASIS.sub(r'<b>\g<bold></b>', text)
+    return REMINDER_MARKER.sub('', text)
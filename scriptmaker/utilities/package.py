@@ -0,0 +1,12 @@
+
+import importlib.metadata
+
+
+def version ():
+    """ 
+    The installed scriptmaker version, or None when running from a source tree.
+    """
+    try:
+        return importlib.metadata.version('scriptmaker')
+    except importlib.metadata.PackageNotFoundError:
+        return None
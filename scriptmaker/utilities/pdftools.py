@@ -1,14 +1,25 @@
 
 import os
 import pdf2image
+import re
 import shutil
 import subprocess
 import tempfile
+import zlib
 
 from pathlib import Path
 
 from .error import ScriptmakerError
 from .filesystem import mkdirp
+from .profiling import span
+
+
+PDF_OBJECT = re.compile(rb"(\d+)\s+0\s+obj\b")
+PDF_STREAM = re.compile(rb"\bstream\r?\n|\bendobj\b")
+PDF_LENGTH = re.compile(rb"/Length\s+(\d+)(?!\d)(?!\s+\d+\s+R)")
+PDF_LENGTH_REF = re.compile(rb"/Length\s+(\d+)\s+\d+\s+R")
+PDF_FONT_NAME = re.compile(rb"/FontName\s*/([^\s/<>\[\]()]+)")
+PDF_FONT_FILE = re.compile(rb"/FontFile[23]?\s+(\d+)\s+0\s+R")
 
 
 class PDFTools ():
@@ -26,7 +37,7 @@ class PDFTools ():
         if filename.suffix != ".pdf":
             raise ScriptmakerError('cannot compress a non-PDF file')
     
-        with tempfile.NamedTemporaryFile() as gs_file:
+        with span('postprocess.compress'), tempfile.NamedTemporaryFile() as gs_file:
             subprocess.call(
                 [
                     'gs', 
@@ -56,12 +67,94 @@ class PDFTools ():
         mkdirp(output_folder)
         
         pdf_name = filename.stem
-        pages = pdf2image.convert_from_path(filename)
         page_paths = []
         
-        for i, page in enumerate(pages):
-            page_path = Path(output_folder, f"{pdf_name}-{i + 1}.png")
-            page_paths.append(page_path)
-            page.save(page_path)
+        with span('postprocess.pngify'):
+            pages = pdf2image.convert_from_path(filename)
+            for i, page in enumerate(pages):
+                page_path = Path(output_folder, f"{pdf_name}-{i + 1}.png")
+                page_paths.append(page_path)
+                page.save(page_path)
+    
+        return page_paths
+    
+    
+    @classmethod
+    def fonts (cls, filename):
+        """
+        Reports the fonts embedded in a PDF: their names, and how many (compressed) bytes each takes up.
+        """
+        with open(filename, 'rb') as pdf_file:
+            content = pdf_file.read()
+        
+        # Gather every object's dictionary, and every stream's length, including objects packed into object streams.
+        dictionaries, lengths = {}, {}
+        position = 0
+        while match := PDF_OBJECT.search(content, position):
+            number = int(match.group(1))
+            end = PDF_STREAM.search(content, match.end())
+            if not end:
+                break
+            dictionary = content[match.end():end.start()]
+            dictionaries[number] = dictionary
+            position = end.end()
+            
+            if end.group().startswith(b'stream'):
+                length = cls.__stream_length(content, dictionary, end.end())
+                if length is None:
+                    break
+                lengths[number] = length
+                data = content[end.end():end.end() + lengths[number]]
+                position = end.end() + lengths[number]
+                if b'/ObjStm' in dictionary:
+                    dictionaries.update(cls.__unpack_objects(dictionary, data))
+        
+        report = []
+        for dictionary in dictionaries.values():
+            name, font_file = PDF_FONT_NAME.search(dictionary), PDF_FONT_FILE.search(dictionary)
+            if b'/FontDescriptor' not in dictionary or not name or not font_file:
+                continue
+            report.append({
+                "name": re.sub(r"^[A-Z]{6}\+", "", name.group(1).decode('latin-1')), # Drop the tag that makes each embedding's name unique
+                "bytes": lengths.get(int(font_file.group(1)), 0)
+            })
+        return report
     
-        return page_paths
\ No newline at end of file
+    
+    @staticmethod
+    def __stream_length (content, dictionary, start):
+        """
+        Finds the length of the stream starting at start, whether its dictionary gives it directly or (as Ghostscript often does) by reference to another object.
+        """
+        length = PDF_LENGTH.search(dictionary)
+        if length:
+            return int(length.group(1))
+        
+        reference = PDF_LENGTH_REF.search(dictionary)
+        if reference:
+            value = re.search(rb"(?<!\d)" + reference.group(1) + rb"\s+0\s+obj\s*(\d+)\s*endobj", content)
+            if value:
+                return int(value.group(1))
+        
+        # Otherwise, measure up to the end of the stream.
+        stop = content.find(b"endstream", start)
+        if stop < 0:
+            return None
+        return len(content[start:stop].removesuffix(b"\n").removesuffix(b"\r"))
+    
+    
+    @staticmethod
+    def __unpack_objects (dictionary, data):
+        """
+        Splits a (flate-compressed) object stream into the dictionaries of the objects inside it.
+        """
+        try:
+            data = zlib.decompress(data) if b'/FlateDecode' in dictionary else data
+            count = int(re.search(rb"/N\s+(\d+)", dictionary).group(1))
+            first = int(re.search(rb"/First\s+(\d+)", dictionary).group(1))
+        except (zlib.error, AttributeError):
+            return {}
+        
+        header = [ int(value) for value in data[:first].split() ][:2 * count]
+        numbers, offsets = header[0::2], header[1::2] + [len(data) - first]
+        return { number: data[first + offsets[i]:first + offsets[i + 1]] for i, number in enumerate(numbers) }
@@ -0,0 +1,154 @@
+
+import contextlib
+import json
+import re
+import threading
+import time
+
+from . import filesystem
+
+
+class Profiler ():
+    """
+    Collects timed spans (how often each stage ran, and for how long) and counters (icons fetched, bytes written, pages produced...).
+    Hooks are called with every event as it happens: hook(kind, name, value), where kind is 'span' (value in seconds) or 'counter' (value the increment).
+    """
+
+    def __init__ (self):
+        """
+        Creates an empty profiler.
+        """
+        self.spans : dict[str, dict] = {}
+        self.counters : dict[str, int] = {}
+        self.hooks = []
+        self.__lock = threading.Lock()
+
+
+    def add_hook (self, hook):
+        """
+        Calls hook(kind, name, value) for every span and counter event from now on.
+        """
+        self.hooks.append(hook)
+        return hook
+
+
+    def count (self, name, amount = 1):
+        """
+        Adds to a counter.
+        """
+        with self.__lock:
+            self.counters[name] = self.counters.get(name, 0) + amount
+        for hook in self.hooks:
+            hook('counter', name, amount)
+
+
+    def drain (self):
+        """
+        Returns the report so far, and starts over.
+        """
+        with self.__lock:
+            report = self.__report()
+            self.spans, self.counters = {}, {}
+        return report
+
+
+    def merge (self, report):
+        """
+        Adds another profiler's report (e.g. from a worker process) into this one.
+        """
+        with self.__lock:
+            for name, span in report['spans'].items():
+                total = self.spans.setdefault(name, { 'count': 0, 'seconds': 0., 'max_seconds': 0. })
+                total['count'] += span['count']
+                total['seconds'] += span['seconds']
+                total['max_seconds'] = max(total['max_seconds'], span['max_seconds'])
+            for name, amount in report['counters'].items():
+                self.counters[name] = self.counters.get(name, 0) + amount
+
+
+    def record (self, name, seconds):
+        """
+        Records one run of a stage.
+        """
+        with self.__lock:
+            span = self.spans.setdefault(name, { 'count': 0, 'seconds': 0., 'max_seconds': 0. })
+            span['count'] += 1
+            span['seconds'] += seconds
+            span['max_seconds'] = max(span['max_seconds'], seconds)
+        for hook in self.hooks:
+            hook('span', name, seconds)
+
+
+    def report (self):
+        """
+        Returns every span and counter so far, as JSON-friendly dicts.
+        """
+        with self.__lock:
+            return self.__report()
+
+
+    @contextlib.contextmanager
+    def span (self, name):
+        """
+        Times the enclosed block as one run of a stage; failed runs are timed too.
+        """
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(name, time.perf_counter() - started)
+
+
+    def write_json (self, path):
+        """
+        Writes the report to a path as JSON.
+        """
+        filesystem.write_atomic(path, json.dumps(self.report(), indent = 2, sort_keys = True).encode())
+
+
+    def write_prometheus (self, path, prefix = 'scriptmaker'):
+        """
+        Writes the report to a path in the Prometheus text format, e.g. for node_exporter's textfile collector.
+        """
+        report = self.report()
+        lines = [
+            f"# TYPE {prefix}_stage_seconds_total counter",
+            *(f'{prefix}_stage_seconds_total{{stage="{name}"}} {span["seconds"]}' for name, span in sorted(report['spans'].items())),
+            f"# TYPE {prefix}_stage_runs_total counter",
+            *(f'{prefix}_stage_runs_total{{stage="{name}"}} {span["count"]}' for name, span in sorted(report['spans'].items())),
+            f"# TYPE {prefix}_stage_max_seconds gauge",
+            *(f'{prefix}_stage_max_seconds{{stage="{name}"}} {span["max_seconds"]}' for name, span in sorted(report['spans'].items()))
+        ]
+        for name, amount in sorted(report['counters'].items()):
+            metric = f"{prefix}_{re.sub(r'[^a-zA-Z0-9_]', '_', name)}_total"
+            lines.extend([f"# TYPE {metric} counter", f"{metric} {amount}"])
+        filesystem.write_atomic(path, ("\n".join(lines) + "\n").encode())
+
+
+    def __report (self):
+        return {
+            'spans': { name: dict(span) for name, span in self.spans.items() },
+            'counters': dict(self.counters)
+        }
+
+
+# The profiler instrumented code reports to; None (the default) turns instrumentation off.
+shared = None
+
+# Handed out by span() while profiling is off, so that disabled instrumentation costs one global lookup.
+NO_SPAN = contextlib.nullcontext()
+
+
+def count (name, amount = 1):
+    """
+    Adds to a counter on the shared profiler, if there is one.
+    """
+    if shared is not None:
+        shared.count(name, amount)
+
+
+def span (name):
+    """
+    Times a block as a stage on the shared profiler, if there is one: with profiling.span('render.jinja'): ...
+    """
+    return shared.span(name) if shared is not None else NO_SPAN
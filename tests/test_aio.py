@@ -0,0 +1,65 @@
+import asyncio
+import threading
+
+from concurrent.futures import ThreadPoolExecutor
+
+from pathlib import Path
+
+from scriptmaker import AsyncRenderer, Datastore
+from scriptmaker.renderer import Renderer
+
+
+def make_script (datastore, name, characters):
+    return datastore.overlay().load_script([ { 'id': '_meta', 'name': name }, *characters ])
+
+
+def test_overlapping_renders_share_no_folders (tmp_path):
+    datastore = Datastore(tmp_path)
+    datastore.add_official_characters(lazy = True)
+    scripts = [ make_script(datastore, "Overlap One", ["imp", "washerwoman"]), make_script(datastore, "Overlap Two", ["imp", "chef"]) ]
+    output_folder = Path(tmp_path, "out")
+
+    async def render_both ():
+        async_renderer = AsyncRenderer(max_concurrent = 2)
+        return await asyncio.gather(*(async_renderer.render_script(script, output_folder = output_folder) for script in scripts))
+
+    paths = asyncio.run(render_both())
+    assert [ path.name for path in paths ] == ["Overlap_One-script.pdf", "Overlap_Two-script.pdf"]
+    assert all(path.read_bytes().startswith(b"%PDF") for path in paths)
+    assert sorted(path.name for path in output_folder.iterdir()) == ["pdf"]
+
+
+def test_cancelled_render_leaves_a_newer_render_alone (tmp_path, monkeypatch):
+    datastore = Datastore(tmp_path)
+    datastore.add_official_characters(lazy = True)
+    script = make_script(datastore, "Cancelled", ["imp"])
+
+    # The first render holds its thread until the second has finished and written the same file.
+    release = threading.Event()
+    calls = []
+    render_script = Renderer.render_script
+    def slow_render_script (self, script, **kwargs):
+        calls.append(script)
+        if len(calls) == 1:
+            release.wait(10)
+        return render_script(self, script, **kwargs)
+    monkeypatch.setattr(Renderer, 'render_script', slow_render_script)
+
+    async def render_twice ():
+        executor = ThreadPoolExecutor(2)
+        async_renderer = AsyncRenderer(executor = executor, max_concurrent = 2)
+        slow = asyncio.ensure_future(async_renderer.render_script(script, output_folder = tmp_path))
+        while not calls:
+            await asyncio.sleep(0.01)
+        slow.cancel()
+        path = await async_renderer.render_script(script, output_folder = tmp_path)
+
+        # Let the first render finish writing, and its clean-up run.
+        release.set()
+        await asyncio.get_running_loop().run_in_executor(None, executor.shutdown)
+        await asyncio.sleep(0.1)
+        assert slow.cancelled()
+        return path
+
+    path = asyncio.run(render_twice())
+    assert path.exists()
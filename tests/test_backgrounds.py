@@ -0,0 +1,40 @@
+import io
+
+from PIL import Image, ImageChops
+
+import scriptmaker.templates as templates
+
+from scriptmaker.renderer import backgrounds
+
+
+def encode (image, format, **options):
+    buffer = io.BytesIO()
+    image.save(buffer, format = format, **options)
+    return buffer.getvalue()
+
+
+def test_variants_are_named_for_their_format ():
+    for file in ["leaf-first.png", "leaf-setup.png"]:
+        art = backgrounds.variant(templates.tokens.get_data, file, 38 / 25.4, 38 / 25.4, 'print')
+        image = Image.open(io.BytesIO(art.content))
+        assert art.name.endswith({ 'WEBP': ".webp", 'PNG': ".png" }[image.format])
+        assert art.mime == Image.MIME[image.format]
+
+
+def test_webp_is_downsampled_losslessly ():
+    # Noise doesn't compress, so the variant is smaller than the source and is kept.
+    source = Image.effect_noise((400, 400), 64).convert('RGBA')
+    content = encode(source, 'WEBP', lossless = True)
+    art = backgrounds.variant(lambda file: content, "noise.png", 1., 1., 'draft')
+
+    assert art.name == "backgrounds/noise-96dpi.webp"
+    assert Image.open(io.BytesIO(art.content)).size == (96, 96)
+    expected = source.resize((96, 96), Image.Resampling.LANCZOS)
+    assert ImageChops.difference(Image.open(io.BytesIO(art.content)).convert('RGBA'), expected).getbbox() is None
+
+
+def test_sources_that_need_no_downsampling_are_kept ():
+    content = encode(Image.new('RGBA', (48, 48), (0, 128, 0, 255)), 'WEBP')
+    art = backgrounds.variant(lambda file: content, "small.png", 1., 1., 'print')
+    assert art.content == content
+    assert art.name == "backgrounds/small.webp"
@@ -0,0 +1,10 @@
+from scriptmaker import Character
+
+
+def test_markup_formats_null_reminders_as_empty ():
+    character = Character.from_dict({
+        'id': 'homebrew', 'name': 'Homebrew', 'team': 'townsfolk', 'ability': "You start knowing 1 thing. [+1 Outsider]", 'image': 'https://example.com/homebrew.png',
+        'firstNightReminder': None, 'otherNightReminder': None
+    })
+    assert character.markup == { 'ability': "You start knowing 1 thing. <b>[+1 Outsider]</b>", 'first': "", 'other': "" }
+    assert character.nightinfo['first']['reminder'] is None
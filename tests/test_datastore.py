@@ -0,0 +1,21 @@
+import hashlib
+import io
+
+from PIL import Image
+
+from scriptmaker import Datastore
+from scriptmaker.data import icons
+
+
+def test_package_icons_changed_since_the_snapshot_are_rehashed (monkeypatch):
+    buffer = io.BytesIO()
+    Image.new('RGBA', (8, 8), (255, 0, 0, 255)).save(buffer, format = 'png')
+    changed = buffer.getvalue()
+    get_data = icons.get_data
+    monkeypatch.setattr(icons, 'get_data', lambda file: changed if file == "Icon_imp.png" else get_data(file))
+
+    datastore = Datastore()
+    datastore.add_official_characters()
+    icon = datastore.get_icon('imp')
+    assert icon.hash == hashlib.sha256(changed).hexdigest()
+    assert icon.crop().icon.size == (8, 8)
@@ -0,0 +1,14 @@
+import pytest
+
+from scriptmaker.renderer import fetcher
+
+
+def test_untrusted_fetcher_serves_only_virtual_assets ():
+    assets = fetcher.VirtualFetcher(allow_external = False)
+    url = assets.add("images/imp.png", b"icon", "image/png")
+    assert assets(url)['string'] == b"icon"
+    assert assets(fetcher.virtual_url("common.css"))['string'] == fetcher.packaged("common.css")
+
+    for url in ["file:///etc/passwd", "http://169.254.169.254/latest/meta-data/", "https://example.com/icon.png"]:
+        with pytest.raises(ValueError):
+            assets(url)
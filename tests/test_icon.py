@@ -0,0 +1,21 @@
+import base64
+import io
+
+from PIL import Image
+
+from scriptmaker import Icon
+
+
+def encode (format):
+    buffer = io.BytesIO()
+    Image.new('RGBA', (4, 4), (0, 0, 255, 255)).save(buffer, format = format)
+    return buffer.getvalue()
+
+
+def test_base64_is_always_a_png ():
+    png = encode('png')
+    assert base64.b64decode(Icon('icon', png).base64()) == png
+
+    decoded = Image.open(io.BytesIO(base64.b64decode(Icon('icon', encode('webp')).base64())))
+    assert decoded.format == 'PNG'
+    assert decoded.size == (4, 4)
@@ -0,0 +1,35 @@
+from scriptmaker.utilities import PDFTools
+
+
+def make_pdf (indirect):
+    """
+    Builds a PDF embedding one font, whose stream length is given directly or (as Ghostscript does) by reference to an object after it.
+    The font data contains what looks like an object, as compressed data might.
+    """
+    font_data = b"\x00" * 500 + b"\n3 0 obj << /FontDescriptor /FontName /Bogus /FontFile2 99 0 R >> endobj\n" + b"\xff" * 424
+    length = b"12 0 R" if indirect else str(len(font_data)).encode()
+    return b"\n".join([
+        b"%PDF-1.7",
+        b"1 0 obj << /Type /FontDescriptor /FontName /ABCDEF+Dumbledor1 /FontFile2 11 0 R >> endobj",
+        b"11 0 obj << /Length " + length + b" >>",
+        b"stream",
+        font_data,
+        b"endstream",
+        b"endobj",
+        b"12 0 obj " + str(len(font_data)).encode() + b" endobj",
+        b"%%EOF"
+    ]), len(font_data)
+
+
+def test_fonts_reads_direct_lengths (tmp_path):
+    content, size = make_pdf(indirect = False)
+    path = tmp_path / "direct.pdf"
+    path.write_bytes(content)
+    assert PDFTools.fonts(path) == [{ 'name': 'Dumbledor1', 'bytes': size }]
+
+
+def test_fonts_resolves_indirect_lengths (tmp_path):
+    content, size = make_pdf(indirect = True)
+    path = tmp_path / "indirect.pdf"
+    path.write_bytes(content)
+    assert PDFTools.fonts(path) == [{ 'name': 'Dumbledor1', 'bytes': size }]
@@ -0,0 +1,130 @@
+import threading
+import time
+
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+
+import pytest
+
+from scriptmaker import AssetCache, Datastore, ScriptmakerCacheError
+from scriptmaker.data import remote
+
+
+class IconHost ():
+    """
+    A local stand-in for an icon host: serves /<name>.png (as its own path, unless given real content) slowly, with an ETag, and records what it was asked for.
+    """
+
+    def __init__ (self, delay = 0.):
+        self.delay = delay
+        self.content = None
+        self.requests = []
+        self.revalidations = 0
+        self.running = 0
+        self.max_running = 0
+        self.lock = threading.Lock()
+
+        host = self
+        class Handler (BaseHTTPRequestHandler):
+            def do_GET (self):
+                with host.lock:
+                    host.requests.append(self.path)
+                    host.running += 1
+                    host.max_running = max(host.max_running, host.running)
+                try:
+                    time.sleep(host.delay)
+                    etag = f'"{self.path}"'
+                    if self.headers.get('If-None-Match') == etag:
+                        with host.lock:
+                            host.revalidations += 1
+                        self.send_response(304)
+                        self.send_header('ETag', etag)
+                        self.end_headers()
+                        return
+                    content = host.content if host.content else self.path.encode()
+                    self.send_response(200)
+                    self.send_header('ETag', etag)
+                    self.send_header('Content-Length', str(len(content)))
+                    self.end_headers()
+                    self.wfile.write(content)
+                finally:
+                    with host.lock:
+                        host.running -= 1
+
+            def log_message (self, format, *args):
+                pass
+
+        self.httpd = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        self.url = f"http://127.0.0.1:{self.httpd.server_port}"
+        threading.Thread(target = self.httpd.serve_forever, daemon = True).start()
+
+    def close (self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+
+@pytest.fixture
+def host ():
+    host = IconHost()
+    yield host
+    host.close()
+
+
+def test_per_host_limit_is_shared_across_fetchers (host):
+    host.delay = 0.1
+    fetchers = [ remote.Fetcher(per_host = 2), remote.Fetcher(per_host = 2) ]
+    batches = [ [ f"{host.url}/{i}-{n}.png" for n in range(6) ] for i in range(len(fetchers)) ]
+    threads = [ threading.Thread(target = fetcher.prefetch, args = (batch,)) for fetcher, batch in zip(fetchers, batches) ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert len(host.requests) == 12
+    assert host.max_running == 2
+    assert fetchers[0].fetch(batches[0][0]) == b"/0-0.png"
+
+
+def test_prefetched_results_are_kept_until_the_batch_is_done (host):
+    fetcher = remote.Fetcher()
+    url = f"{host.url}/shared.png"
+    fetcher.prefetch([url, url])
+    assert fetcher.fetch(url) == fetcher.fetch(url) == b"/shared.png"
+    assert host.requests == ["/shared.png"]
+
+    fetcher.discard()
+    fetcher.fetch(url)
+    assert len(host.requests) == 2
+
+
+def test_load_script_fetches_a_shared_homebrew_image_once (host, tmp_path):
+    host.content = Path(Path(remote.__file__).parent, "icons", "Icon_imp.png").read_bytes()
+    image = f"{host.url}/icon.png"
+    datastore = Datastore(tmp_path)
+    datastore.add_official_characters(lazy = True)
+    script = datastore.load_script([
+        { 'id': '_meta', 'name': "Shared Image" },
+        *({ 'id': f"homebrew_{i}", 'name': f"Homebrew {i}", 'team': 'townsfolk', 'ability': "Nothing.", 'image': image } for i in range(2))
+    ])
+    assert len(script.characters) == 2
+    assert host.requests == ["/icon.png"]
+
+
+def test_cache_revalidates_with_etags (host, tmp_path):
+    cache = AssetCache(tmp_path, ttl = 0)
+    url = f"{host.url}/icon.png"
+    assert cache.fetch(url) == b"/icon.png"
+    assert cache.fetch(url) == b"/icon.png"
+    assert host.revalidations == 1
+    assert cache.stats['revalidated'] == 1
+
+
+def test_offline_cache_serves_stale_entries_and_refuses_misses (host, tmp_path):
+    url = f"{host.url}/icon.png"
+    AssetCache(tmp_path).fetch(url)
+
+    offline = AssetCache(tmp_path, ttl = 0, offline = True)
+    assert offline.fetch(url) == b"/icon.png"
+    with pytest.raises(ScriptmakerCacheError):
+        offline.fetch(f"{host.url}/missing.png")
+    assert host.requests == ["/icon.png"]
@@ -0,0 +1,54 @@
+import http.client
+import json
+import threading
+
+from http.server import ThreadingHTTPServer
+
+import pytest
+
+from scriptmaker import Datastore
+from scriptmaker import server
+
+
+@pytest.fixture
+def address (tmp_path):
+    datastore = Datastore(tmp_path)
+    datastore.add_official_characters(lazy = True)
+    httpd = ThreadingHTTPServer(('127.0.0.1', 0), server.RequestHandler)
+    httpd.daemon_threads = True
+    httpd.render_server = server.RenderServer(datastore, workers = 1)
+    threading.Thread(target = httpd.serve_forever, daemon = True).start()
+    yield httpd.server_address
+    httpd.shutdown()
+    httpd.server_close()
+
+
+def post (address, headers, body = b""):
+    connection = http.client.HTTPConnection(*address, timeout = 10)
+    connection.putrequest('POST', '/render')
+    for name, value in headers.items():
+        connection.putheader(name, value)
+    connection.endheaders(body)
+    response = connection.getresponse()
+    content = response.read()
+    connection.close()
+    return response.status, content
+
+
+@pytest.mark.parametrize('headers, status', [
+    ({}, 411),
+    ({ 'Content-Length': 'lots' }, 400),
+    ({ 'Content-Length': '-1' }, 400),
+    ({ 'Content-Length': str(server.MAX_BODY_BYTES + 1) }, 413)
+])
+def test_bad_content_lengths_are_refused (address, headers, status):
+    code, content = post(address, headers)
+    assert code == status
+    assert 'error' in json.loads(content)
+
+
+def test_bodies_are_read_to_their_content_length (address):
+    body = b"[not json"
+    code, content = post(address, { 'Content-Length': str(len(body)) }, body)
+    assert code == 400
+    assert "not JSON" in json.loads(content)['error']